@@ -17,19 +17,26 @@ How to run
 1.  pip install -r requirements.txt
 2.  python app.py          # starts the dev server on http://127.0.0.1:5000
 
-A default **admin** account is created on first run:
+Under gunicorn/WSGI, run `flask --app app init-db` once per deploy first.
+
+A default **admin** account is created by init-db (and by `python app.py`):
     username: admin   |   password: admin123
 """
 
 import time as _time
 
-import io
+import hashlib
+import json
 import os
+import re
+import sqlite3
 import subprocess
-from datetime import datetime, timedelta, timezone
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time, timedelta, timezone
 from functools import wraps
-from urllib.parse import urlsplit
 
+import click
 from dotenv import load_dotenv
 from flask import (
     Flask,
@@ -56,7 +63,14 @@ from flask_login import (
 from flask_mail import Mail, Message
 from flask_wtf.csrf import CSRFError, CSRFProtect
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Alignment, Font, PatternFill
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session as OrmSession
+from sqlalchemy.orm import contains_eager, joinedload, selectinload
+from werkzeug.http import is_resource_modified
 
 from models import (
     AuditLog,
@@ -67,8 +81,10 @@ from models import (
     User,
     Vehicle,
     VehicleLocation,
+    booking_conflict_criteria,
     check_booking_conflict,
     db,
+    lock_vehicle_bookings,
 )
 
 # ── App & config ─────────────────────────────────────────────────────────────
@@ -86,6 +102,14 @@ if database_url.startswith("postgres://"):
     database_url = database_url.replace("postgres://", "postgresql://", 1)
 app.config["SQLALCHEMY_DATABASE_URI"] = database_url
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+# Server databases get a warm, pre-pinged, recycled pool; SQLite keeps the default.
+if not database_url.startswith("sqlite"):
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_size": 10,
+        "max_overflow": 20,
+        "pool_pre_ping": True,
+        "pool_recycle": 300,
+    }
 app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "cosme-dev-secret-key")
 
 # ── Session / Cookie config ─────────────────────────────────────────────────
@@ -94,6 +118,9 @@ app.config["SESSION_COOKIE_SAMESITE"] = "Lax"
 # Only require Secure cookies when explicitly running behind HTTPS
 app.config["SESSION_COOKIE_SECURE"] = os.environ.get("SESSION_COOKIE_SECURE", "0") == "1"
 app.config["SESSION_COOKIE_HTTPONLY"] = True
+# Re-issue the cookie only when the session changes; check_session_timeout()
+# touches it at most once a minute, which keeps the expiry sliding
+app.config["SESSION_REFRESH_EACH_REQUEST"] = False
 app.config["WTF_CSRF_TIME_LIMIT"] = None  # CSRF tokens valid for entire session (no expiry)
 app.config["WTF_CSRF_SSL_STRICT"] = False  # Don't require strict Referer checking for HTTPS
 
@@ -108,6 +135,30 @@ app.config["MAIL_DEFAULT_SENDER"] = os.environ.get(
     "MAIL_DEFAULT_SENDER", "noreply@cosme-project.org"
 )
 
+# ── SQLite tuning (applied to every new connection) ─────────────────────────
+
+
+# How long a SQLite writer waits for the write lock (BEGIN IMMEDIATE in
+# lock_vehicle_bookings) before giving up and asking the user to retry
+SQLITE_BUSY_TIMEOUT_MS = 5000
+
+
+@event.listens_for(Engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Enable WAL, NORMAL sync, foreign keys and a busy timeout on SQLite."""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return  # PostgreSQL etc. – nothing to do
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA cache_size=-64000")  # ~64 MB page cache
+    cursor.execute("PRAGMA mmap_size=268435456")  # 256 MB
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
 db.init_app(app)
 mail = Mail(app)
 csrf = CSRFProtect(app)
@@ -115,6 +166,12 @@ limiter = Limiter(app=app, key_func=get_remote_address, default_limits=[])
 
 # ── Pagination ───────────────────────────────────────────────────────────────
 PER_PAGE = 20
+REPORT_DAY_END = time(23, 59, 59)  # reports include trips up to this time on the last day
+DASHBOARD_UPCOMING_LIMIT = 10  # rows shown in the dashboard "upcoming" table
+
+# ── Form validation patterns ─────────────────────────────────────────────────
+USERNAME_RE = re.compile(r"\A(?=.*[a-z0-9])[a-z0-9._]+\Z")  # lower-cased first
+EMAIL_RE = re.compile(r"\A[^@\s]+@[^@\s]+\.[^@\s]+\Z")
 
 # ── Flask-Login setup ────────────────────────────────────────────────────────
 
@@ -146,7 +203,12 @@ def inject_today_date():
 @app.before_request
 def ensure_session():
     """Make every session permanent so the cookie persists across requests."""
-    session.permanent = True
+    if not session.permanent:  # assigning marks the session modified
+        session.permanent = True
+
+
+# How stale the recorded activity time may get before it is rewritten
+SESSION_ACTIVITY_RESOLUTION = 60  # seconds
 
 
 @app.before_request
@@ -154,17 +216,17 @@ def check_session_timeout():
     """Log out the user if they have been inactive for more than 30 minutes."""
     if current_user.is_authenticated:
         now = datetime.now(timezone.utc)
+        # Stored aware; the session serializer hands it back as aware UTC
         last_active = session.get("last_active")
         if last_active is not None:
-            # Ensure last_active is timezone-aware (UTC) for safe subtraction
-            if hasattr(last_active, 'tzinfo') and last_active.tzinfo is None:
-                last_active = last_active.replace(tzinfo=timezone.utc)
             elapsed = (now - last_active).total_seconds()
             if elapsed > 30 * 60:  # 30 minutes
                 logout_user()
                 session.clear()
                 flash("Your session has expired due to inactivity. Please log in again.", "warning")
                 return redirect(url_for("login"))
+            if elapsed < SESSION_ACTIVITY_RESOLUTION:
+                return None  # recent enough; leave the cookie alone
         session["last_active"] = now
 
 
@@ -238,13 +300,21 @@ def _analytics_track_page_view(response):
         if hasattr(request, "_analytics_start"):
             elapsed = round((_time.monotonic() - request._analytics_start) * 1000, 1)
 
+        user_id = current_user.id if current_user.is_authenticated else None
+        username = current_user.username if current_user.is_authenticated else None
+        # Views commit their own work; anything still pending here was
+        # abandoned, and must not ride along with the page view's commit
+        if db.session.new or db.session.dirty or db.session.deleted:
+            app.logger.warning("Discarding uncommitted changes left by %s", request.endpoint)
+        db.session.rollback()
+
         pv = PageView(
             path=path[:500],
             endpoint=request.endpoint,
             method=request.method,
             status_code=response.status_code,
-            user_id=current_user.id if current_user.is_authenticated else None,
-            username=current_user.username if current_user.is_authenticated else None,
+            user_id=user_id,
+            username=username,
             ip_address=request.remote_addr,
             user_agent=ua_string[:500] if ua_string else None,
             referrer=(request.referrer or "")[:500] or None,
@@ -283,7 +353,7 @@ def role_required(*roles):
 
 
 def log_action(action, entity_type, entity_id=None, details=None):
-    """Record an audit-log entry for the current user."""
+    """Add an audit-log entry for the current user; the caller commits it."""
     entry = AuditLog(
         user_id=current_user.id if current_user.is_authenticated else None,
         username=current_user.username if current_user.is_authenticated else "system",
@@ -293,33 +363,503 @@ def log_action(action, entity_type, entity_id=None, details=None):
         details=details,
     )
     db.session.add(entry)
-    db.session.commit()
 
 
 # ── Email helper ─────────────────────────────────────────────────────────────
 
 
-def send_notification(subject, recipients, body):
-    """Send an email notification (only if MAIL_ENABLED is true)."""
-    if not app.config["MAIL_ENABLED"]:
-        return  # silently skip
+# SMTP handshakes can take seconds, so messages are handed to a small worker
+# pool and the request returns as soon as the message is queued.
+_mail_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="mail")
+
+
+def _deliver_mail(messages):
+    """Send *messages* from a worker thread over a single SMTP connection."""
+    with app.app_context():
+        try:
+            with mail.connect() as conn:
+                for msg in messages:
+                    conn.send(msg)
+        except Exception as e:
+            app.logger.error(f"Failed to send email: {e}")
+
+
+def send_notifications(notifications):
+    """Queue send_notification() argument dicts for delivery over one SMTP session."""
+    if not app.config["MAIL_ENABLED"] or not notifications:
+        return None  # silently skip
     try:
-        msg = Message(subject=subject, recipients=recipients, body=body)
-        mail.send(msg)
+        messages = [Message(**n) for n in notifications]
+        return _mail_executor.submit(_deliver_mail, messages)
     except Exception as e:
         app.logger.error(f"Failed to send email: {e}")
+        return None
+
+
+def send_notification(subject, recipients, body, bcc=None):
+    """Queue a single email notification; see send_notifications()."""
+    return send_notifications(
+        [dict(subject=subject, recipients=recipients, body=body, bcc=bcc)]
+    )
+
+
+_MONTH_ABBR = ("Jan", "Feb", "Mar", "Apr", "May", "Jun",
+               "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+
+def format_datetime(d):
+    """Format *d* as ``01 Jan 2025 08:30`` without strftime's locale lookup."""
+    return f"{d.day:02d} {_MONTH_ABBR[d.month - 1]} {d.year} {d.hour:02d}:{d.minute:02d}"
+
+
+# Notification bodies, parsed once and filled in with str.format_map(): the
+# booking ones from booking_email_context() plus the recipient's "name".
+_BOOKING_DETAILS = (
+    "Vehicle: {vehicle}\n"
+    "Route: {route_from} → {route_to}\n"
+    "From: {start}\n"
+    "To: {end}\n\n"
+)
+EMAIL_TEMPLATES = {
+    "new_booking_admin": (
+        "Hello Admin,\n\n"
+        "A new vehicle booking request has been submitted.\n\n"
+        "Booking #: {id}\n"
+        "Requested by: {requester_name}\n"
+        "Vehicle: {vehicle}\n"
+        "Route: {route_from} → {route_to}\n"
+        "Purpose: {purpose}\n"
+        "From: {start}\n"
+        "To: {end}\n\n"
+        "Please log in to review and approve/reject this request.\n\n"
+        "– Vehicle Request Tracker"
+    ),
+    "new_booking_requester": (
+        "Hello {name},\n\n"
+        "Your vehicle booking request has been submitted successfully.\n\n"
+        "Booking #: {id}\n"
+        + _BOOKING_DETAILS +
+        "Status: PENDING – awaiting admin approval.\n"
+        "You will receive another email once your request is approved or cancelled.\n\n"
+        "– Vehicle Request Tracker"
+    ),
+    "approved_requester": (
+        "Hello {name},\n\n"
+        "Your vehicle booking #{id} has been approved.\n\n"
+        + _BOOKING_DETAILS +
+        "– Vehicle Request Tracker"
+    ),
+    "driver_assigned": (
+        "Hello {name},\n\n"
+        "You have been assigned as driver for booking #{id}.\n\n"
+        + _BOOKING_DETAILS +
+        "– Vehicle Request Tracker"
+    ),
+    "cancelled_requester": (
+        "Hello {name},\n\n"
+        "Your vehicle booking #{id} has been cancelled{cancelled_by}.\n\n"
+        + _BOOKING_DETAILS +
+        "If you have questions, please contact the admin.\n\n"
+        "– Vehicle Request Tracker"
+    ),
+    "cancelled_driver": (
+        "Hello {name},\n\n"
+        "Booking #{id} you were assigned to has been cancelled.\n\n"
+        + _BOOKING_DETAILS +
+        "– Vehicle Request Tracker"
+    ),
+}
+PASSWORD_RESET_EMAIL = (
+    "Hello {name},\n\n"
+    "A password reset was requested for your account ({username}).\n\n"
+    "Click the link below to reset your password (valid for 24 hours):\n"
+    "{reset_url}\n\n"
+    "If you did not request this, please ignore this email.\n\n"
+    "— Vehicle Request Tracker"
+)
+
+
+def booking_email_context(booking):
+    """Values shared by every notification about *booking*, formatted once."""
+    return {
+        "id": booking.id,
+        "requester_name": booking.requester_name,
+        "vehicle": booking.vehicle.registration_number,
+        "route_from": booking.route_from,
+        "route_to": booking.route_to,
+        "purpose": booking.purpose,
+        "start": format_datetime(booking.start_datetime_planned),
+        "end": format_datetime(booking.end_datetime_planned),
+    }
+
+
+def booking_conflict_message(conflict, subject="This vehicle"):
+    """Flash text describing the existing booking that *conflict*s."""
+    fmt = "%Y-%m-%d %H:%M"
+    return (
+        f"{subject} is already booked between "
+        f"{conflict.start_datetime_planned.strftime(fmt)} and "
+        f"{conflict.end_datetime_planned.strftime(fmt)} "
+        f"(Booking #{conflict.id} by {conflict.requester_name})."
+    )
+
+
+# ── Form dropdown helpers ────────────────────────────────────────────────────
+
+# Picker options: a few columns, shared by all users and kept in-process briefly.
+CHOICES_TTL = 60  # seconds
+_choices_cache = {}
+
+_VEHICLE_CHOICES = (
+    db.select(Vehicle.id, Vehicle.registration_number, Vehicle.make, Vehicle.model, Vehicle.status)
+    .where(Vehicle.is_deleted == False)
+    .order_by(Vehicle.registration_number)
+)
+_DRIVER_CHOICES = (
+    db.select(User.id, User.full_name)
+    .where(User.role == "driver", User.is_active_user == True)
+    .order_by(User.full_name)
+)
+
+
+def _cached_choices(key, stmt):
+    now = _time.monotonic()
+    cached = _choices_cache.get(key)
+    if cached is None or now >= cached[0]:
+        cached = _choices_cache[key] = (now + CHOICES_TTL, tuple(db.session.execute(stmt).all()))
+    return cached[1]
+
+
+def vehicle_choices():
+    """Rows of (id, registration_number, make, model, status) for vehicle pickers."""
+    return _cached_choices("vehicles", _VEHICLE_CHOICES)
+
+
+def driver_choices():
+    """Rows of (id, full_name) for every active driver."""
+    return _cached_choices("drivers", _DRIVER_CHOICES)
+
+
+def invalidate_vehicle_choices():
+    """Force the next vehicle_choices() call to re-query the database."""
+    _choices_cache.pop("vehicles", None)
+
+
+def invalidate_driver_choices():
+    """Force the next driver_choices() call to re-query the database."""
+    _choices_cache.pop("drivers", None)
+
+
+# ── Existence checks ─────────────────────────────────────────────────────────
+
+
+def record_exists(*criteria):
+    """True if any row matches *criteria*; asks for EXISTS, loads nothing."""
+    return db.session.execute(db.select(db.exists().where(*criteria))).scalar()
+
+
+# ── Form field parsing ───────────────────────────────────────────────────────
+
+
+def form_field(errors, name, parse, invalid, required=None, negative=None):
+    """Parse ``request.form[name]`` with *parse*; blank or bad values add to *errors*."""
+    raw = request.form.get(name, "").strip()
+    if not raw:
+        if required:
+            errors.append(required)
+        return None
+    try:
+        value = parse(raw)
+    except ValueError:
+        errors.append(invalid)
+        return None
+    if negative and value < 0:
+        errors.append(negative)
+    return value
+
+
+# ── Keyset pagination ────────────────────────────────────────────────────────
+
+# Newest-first lists page on (sort column, id) instead of OFFSET.
+
+
+def list_cursor(when, row_id):
+    """Encode a row's position in a keyset-paged list as ``<when>_<id>``."""
+    return f"{when.isoformat()}_{row_id}"
+
+
+def parse_list_cursor(raw):
+    """Decode a list_cursor() value to (when, id); None if absent or garbled."""
+    when, sep, row_id = (raw or "").rpartition("_")
+    if not sep:
+        return None
+    try:
+        return datetime.fromisoformat(when), int(row_id)
+    except ValueError:
+        return None
+
+
+def keyset_page(query, sort_col, id_col):
+    """Return (rows, newer, older) for the ``?before=``/``?after=`` page, newest first."""
+    key = db.tuple_(sort_col, id_col)
+    after = parse_list_cursor(request.args.get("after"))
+    if after is not None:  # stepping back towards newer rows
+        rows = (
+            query.filter(key > db.tuple_(*after))
+            .order_by(sort_col, id_col)
+            .limit(PER_PAGE + 1)
+            .all()
+        )
+        has_newer, has_older = len(rows) > PER_PAGE, True
+        items = rows[:PER_PAGE][::-1]
+    else:
+        before = parse_list_cursor(request.args.get("before"))
+        if before is not None:
+            query = query.filter(key < db.tuple_(*before))
+        rows = (
+            query.order_by(sort_col.desc(), id_col.desc())
+            .limit(PER_PAGE + 1)
+            .all()
+        )
+        has_newer, has_older = before is not None, len(rows) > PER_PAGE
+        items = rows[:PER_PAGE]
+
+    def cursor(item):
+        return list_cursor(getattr(item, sort_col.key), getattr(item, id_col.key))
+
+    newer = cursor(items[0]) if has_newer and items else None
+    older = cursor(items[-1]) if has_older and items else None
+    return items, newer, older
+
+
+# ── Admin e-mail cache ───────────────────────────────────────────────────────
+
+# Admin addresses for new-booking notifications, kept in-process briefly.
+ADMIN_EMAILS_TTL = 60  # seconds
+_admin_emails_cache = {"emails": None, "expires": 0.0}
+
+
+def get_admin_emails():
+    """Return the e-mail addresses of all active admins (cached)."""
+    now = _time.monotonic()
+    if _admin_emails_cache["emails"] is None or now >= _admin_emails_cache["expires"]:
+        emails = db.session.execute(
+            db.select(User.email).where(User.role == "admin", User.is_active_user == True)
+        ).scalars().all()
+        _admin_emails_cache["emails"] = [e for e in emails if e]
+        _admin_emails_cache["expires"] = now + ADMIN_EMAILS_TTL
+    return _admin_emails_cache["emails"]
+
+
+def invalidate_admin_emails():
+    """Force the next get_admin_emails() call to re-query the database."""
+    _admin_emails_cache["emails"] = None
+
+
+# ── Conditional GET (ETag / Last-Modified) ───────────────────────────────────
+
+# Changes on every redeploy of the code or templates.
+_RELEASE_STAMP = str(max(
+    [os.path.getmtime(__file__)]
+    + [
+        os.path.getmtime(os.path.join(root, name))
+        for root, _dirs, names in os.walk(os.path.join(app.root_path, "templates"))
+        for name in names
+    ]
+))
+
+
+def render_conditional(model, render):
+    """Answer 304 if the client's ETag for *model*'s table and viewer still matches, else render()."""
+    last_modified, row_count = db.session.execute(
+        db.select(db.func.max(model.updated_at), db.func.count()).select_from(model)
+    ).one()
+    if last_modified is not None and last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+
+    etag = hashlib.sha256("|".join(map(str, (
+        model.__tablename__, last_modified, row_count,
+        current_user.id, current_user.updated_at, current_user.role,
+        current_user.full_name, current_user.email,
+        session.get("csrf_token"), request.full_path, _RELEASE_STAMP,
+    ))).encode()).hexdigest()
+
+    if "_flashes" not in session and not is_resource_modified(request.environ, etag=etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.make_response(render())
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Browser may keep the page but must revalidate it on every visit
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+# ── Calendar feed cache ──────────────────────────────────────────────────────
+
+# Calendar feed responses per date window, kept in-process briefly.
+CALENDAR_CACHE_TTL = 30  # seconds
+CALENDAR_CACHE_MAX = 128  # distinct date windows kept at once
+_calendar_cache = {}
+
+# Escapes user route text for event titles in one pass
+_HTML_ESCAPE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;"})
+
+_COLOR_PENDING = "#ffc107"   # yellow
+_COLOR_APPROVED = "#198754"  # green
+
+# The feed's events are plain str/int dicts; no sorting or ASCII escaping needed
+_calendar_json = json.JSONEncoder(
+    ensure_ascii=False, check_circular=False, separators=(",", ":")
+).encode
+
+
+def invalidate_calendar_cache():
+    """Forget every cached calendar feed."""
+    _calendar_cache.clear()
+
+
+# ── Dashboard counter cache ──────────────────────────────────────────────────
+
+# Dashboard counters, shared by all viewers and kept in-process briefly.
+DASHBOARD_COUNTS_TTL = 30  # seconds
+_dashboard_counts_cache = {"counts": None, "expires": 0.0}
+
+
+def get_dashboard_counts(upcoming_criteria):
+    """Return (vehicles, pending bookings, maintenance due, upcoming bookings)."""
+    now = _time.monotonic()
+    if _dashboard_counts_cache["counts"] is None or now >= _dashboard_counts_cache["expires"]:
+        # All four counters in a single round-trip
+        _dashboard_counts_cache["counts"] = tuple(db.session.execute(
+            db.select(
+                db.select(db.func.count(Vehicle.id))
+                .where(Vehicle.is_deleted == False).scalar_subquery(),
+                db.select(db.func.count(Booking.id))
+                .where(Booking.status == "pending", Booking.is_deleted == False).scalar_subquery(),
+                db.select(db.func.count(MaintenanceRecord.id))
+                .where(MaintenanceRecord.status == "scheduled", MaintenanceRecord.is_deleted == False)
+                .scalar_subquery(),
+                db.select(db.func.count(Booking.id)).where(*upcoming_criteria).scalar_subquery(),
+            )
+        ).one())
+        _dashboard_counts_cache["expires"] = now + DASHBOARD_COUNTS_TTL
+    return _dashboard_counts_cache["counts"]
+
+
+def invalidate_dashboard_counts():
+    """Force the next get_dashboard_counts() call to re-query the database."""
+    _dashboard_counts_cache["counts"] = None
+
+
+# ── Cache invalidation on commit ─────────────────────────────────────────────
+
+# Which of the caches above go stale when rows of each model change
+_CACHE_INVALIDATORS = {
+    Booking: (invalidate_calendar_cache, invalidate_dashboard_counts),
+    Vehicle: (invalidate_calendar_cache, invalidate_dashboard_counts, invalidate_vehicle_choices),
+    MaintenanceRecord: (invalidate_dashboard_counts,),
+    User: (invalidate_admin_emails, invalidate_driver_choices),
+}
+
+
+def _mark_stale(session, model):
+    session.info.setdefault("stale_caches", set()).update(_CACHE_INVALIDATORS.get(model, ()))
+
+
+@event.listens_for(OrmSession, "before_flush")
+def _note_cached_changes(session, flush_context, instances):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        _mark_stale(session, type(obj))
+
+
+@event.listens_for(OrmSession, "do_orm_execute")
+def _note_bulk_cached_changes(orm_execute_state):
+    # Set-based UPDATE/DELETE statements bypass the flush
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) and (
+        orm_execute_state.bind_mapper is not None
+    ):
+        _mark_stale(orm_execute_state.session, orm_execute_state.bind_mapper.class_)
+
+
+@event.listens_for(OrmSession, "after_commit")
+def _drop_stale_caches(session):
+    for invalidate in session.info.pop("stale_caches", ()):
+        invalidate()
+
+
+@event.listens_for(OrmSession, "after_rollback")
+def _forget_cached_changes(session):
+    session.info.pop("stale_caches", None)
 
 
 # ── Create DB tables & default admin ─────────────────────────────────────────
 
-with app.app_context():
+# Run once per deploy with `flask --app app init-db` rather than on import, so
+# worker processes start without touching the schema or racing each other.
+
+
+def add_vehicle_status_check(engine):
+    """Add ck_vehicle_status to an older vehicles table; True once it is in place."""
+    from sqlalchemy import inspect, text
+    from sqlalchemy.schema import CreateTable
+
+    table = Vehicle.__table__
+    check = next(c for c in table.constraints if c.name == "ck_vehicle_status")
+    if any(c["name"] == check.name for c in inspect(engine).get_check_constraints("vehicles")):
+        return True
+
+    with engine.connect() as conn:
+        bad = conn.execute(text(
+            f"SELECT id, status FROM vehicles WHERE NOT ({check.sqltext})"
+        )).all()
+        if bad:
+            app.logger.warning(
+                "vehicles has rows with an unknown status, so %s was not added: %s",
+                check.name, ", ".join(f"#{vid} ({status!r})" for vid, status in bad),
+            )
+            return False
+
+        # SQLite can't add a constraint in place, so the table is rebuilt
+        if conn.dialect.name != "sqlite":
+            conn.execute(text(
+                f"ALTER TABLE vehicles ADD CONSTRAINT {check.name} CHECK ({check.sqltext})"
+            ))
+            conn.commit()
+            return True
+
+        # PRAGMA foreign_keys is a no-op inside a transaction
+        conn.exec_driver_sql("PRAGMA foreign_keys=OFF")
+        conn.commit()
+        try:
+            columns = ", ".join(c.name for c in table.columns)
+            rebuilt = table.to_metadata(db.MetaData(), name="vehicles_new")
+            conn.exec_driver_sql("BEGIN")
+            conn.execute(CreateTable(rebuilt))
+            conn.exec_driver_sql(
+                f"INSERT INTO vehicles_new ({columns}) SELECT {columns} FROM vehicles"
+            )
+            conn.exec_driver_sql("DROP TABLE vehicles")
+            conn.exec_driver_sql("ALTER TABLE vehicles_new RENAME TO vehicles")
+            conn.commit()
+        finally:
+            conn.exec_driver_sql("PRAGMA foreign_keys=ON")
+            conn.commit()
+    return True
+
+
+def init_db():
+    """Create missing tables, columns and indexes, and the default admin."""
     db.create_all()
 
     # ── Auto-migrate: add soft-delete columns to existing tables ─────────
     from sqlalchemy import inspect, text
     inspector = inspect(db.engine)
     soft_delete_columns = {
-        "vehicles": ["is_deleted", "deleted_at"],
+        "users": ["updated_at"],
+        "vehicles": ["is_deleted", "deleted_at", "updated_at"],
         "bookings": ["is_deleted", "deleted_at"],
         "trips": ["is_deleted", "deleted_at", "fuel_cost_per_litre", "fuel_level_start", "fuel_level_end"],
         "maintenance_records": ["is_deleted", "deleted_at"],
@@ -332,9 +872,9 @@ with app.app_context():
                     db.session.execute(text(
                         f"ALTER TABLE {table_name} ADD COLUMN is_deleted BOOLEAN NOT NULL DEFAULT 0"
                     ))
-                elif col_name == "deleted_at":
+                elif col_name in ("deleted_at", "updated_at"):
                     db.session.execute(text(
-                        f"ALTER TABLE {table_name} ADD COLUMN deleted_at DATETIME"
+                        f"ALTER TABLE {table_name} ADD COLUMN {col_name} DATETIME"
                     ))
                 elif col_name == "fuel_cost_per_litre":
                     db.session.execute(text(
@@ -346,8 +886,34 @@ with app.app_context():
                     ))
         db.session.commit()
 
+    # ── Auto-migrate: vehicle status constraint ─────────────────────────
+    # A rebuilt vehicles table gets its indexes back in the next step
+    db.session.close()
+    add_vehicle_status_check(db.engine)
+
+    # ── Auto-migrate: create indexes missing from existing databases ─────
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+    # Indexes replaced by the ones above; databases set up before the
+    # replacement still carry them
+    for old_index in (
+        "ix_booking_status", "ix_booking_vehicle_time", "ix_booking_vehicle_status_end",
+    ):
+        db.session.execute(text(f"DROP INDEX IF EXISTS {old_index}"))
+    db.session.commit()
+
+    # ── Report rows left dangling before foreign keys were enforced ─────
+    if db.engine.dialect.name == "sqlite":
+        dangling = db.session.execute(text("PRAGMA foreign_key_check")).all()
+        if dangling:
+            app.logger.warning(
+                "Rows with dangling foreign keys: %s",
+                ", ".join(f"{table} rowid {rowid} -> {parent}" for table, rowid, parent, _ in dangling),
+            )
+
     # Create default admin if none exists
-    if not User.query.filter_by(username="admin").first():
+    if not record_exists(User.username == "admin"):
         admin = User(
             username="admin",
             email="admin@cosme-project.org",
@@ -360,6 +926,13 @@ with app.app_context():
         db.session.commit()
 
 
+@app.cli.command("init-db")
+def init_db_command():
+    """Create or upgrade the database and seed the default admin account."""
+    init_db()
+    click.echo("Database initialised.")
+
+
 # ╔═══════════════════════════════════════════════════════════════════════════╗
 # ║  PWA  –  Service Worker & Offline Page                                  ║
 # ╚═══════════════════════════════════════════════════════════════════════════╝
@@ -384,8 +957,18 @@ def offline():
 # ╚═══════════════════════════════════════════════════════════════════════════╝
 
 
+def is_local_path(target):
+    """True if *target* is a path on this site (not a URL, ``//host`` or ``/\\host``)."""
+    return bool(
+        target
+        and target[0] == "/"
+        and target[1:2] not in ("/", "\\")
+        and target.isprintable()
+    )
+
+
 @app.route("/login", methods=["GET", "POST"])
-@limiter.limit("10/minute")
+@limiter.limit("5/minute")  # bounds the password-hashing work one client can trigger
 def login():
     if current_user.is_authenticated:
         return redirect(url_for("dashboard"))
@@ -398,19 +981,26 @@ def login():
             flash("Please enter both username and password.", "danger")
             return render_template("auth/login.html")
 
-        user = User.query.filter_by(username=username).first()
-        if user and user.check_password(password):
+        user = db.session.execute(
+            db.select(User).where(User.username == username)
+        ).scalar_one_or_none()
+        if user is None:
+            User.check_password_for_unknown_user(password)
+        elif user.check_password(password):
             if not user.is_active_user:
                 flash("Your account has been deactivated. Contact an administrator.", "danger")
                 return render_template("auth/login.html")
+            # Upgrade hashes left over from an older method while the
+            # plaintext is at hand; costs one extra hash, once per user
+            if user.password_needs_rehash():
+                user.set_password(password)
+                db.session.commit()
             login_user(user)
             flash(f"Welcome back, {user.full_name}!", "success")
             next_page = request.args.get("next")
-            # Prevent open-redirect: reject absolute URLs
-            if next_page:
-                parsed = urlsplit(next_page)
-                if parsed.netloc or parsed.scheme:
-                    next_page = None
+            # Prevent open-redirect: only follow paths on this site
+            if not is_local_path(next_page):
+                next_page = None
             return redirect(next_page or url_for("dashboard"))
         flash("Invalid username or password.", "danger")
 
@@ -453,8 +1043,8 @@ def change_password():
 
         current_user.set_password(new_pw)
         current_user.must_change_password = False
-        db.session.commit()
         log_action("edit", "User", current_user.id, "Changed own password")
+        db.session.commit()
         flash("Your password has been changed successfully.", "success")
         return redirect(url_for("dashboard"))
 
@@ -480,11 +1070,11 @@ def register():
             errors.append("Username is required.")
         elif len(username) < 3:
             errors.append("Username must be at least 3 characters.")
-        elif not username.replace("_", "").replace(".", "").isalnum():
+        elif not USERNAME_RE.match(username):
             errors.append("Username may only contain letters, numbers, dots, and underscores.")
         if not email:
             errors.append("Email is required.")
-        elif "@" not in email or "." not in email.split("@")[-1]:
+        elif not EMAIL_RE.match(email):
             errors.append("Please enter a valid email address.")
 
         # Password checks
@@ -495,11 +1085,16 @@ def register():
         if password != password2:
             errors.append("Passwords do not match.")
 
-        # Uniqueness
+        # Uniqueness – one lookup covers both unique columns
         if not errors:
-            if User.query.filter_by(username=username).first():
+            taken = db.session.execute(
+                db.select(User.username, User.email).where(
+                    db.or_(User.username == username, User.email == email)
+                )
+            ).all()
+            if any(row.username == username for row in taken):
                 errors.append("Username already taken.")
-            if User.query.filter_by(email=email).first():
+            if any(row.email == email for row in taken):
                 errors.append("Email already registered.")
 
         if errors:
@@ -515,7 +1110,13 @@ def register():
         )
         user.set_password(password)
         db.session.add(user)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Someone claimed the name or email between the check and now
+            db.session.rollback()
+            flash("That username or email has just been registered – please choose another.", "danger")
+            return render_template("auth/register.html")
         flash("Account created! You can now log in.", "success")
         return redirect(url_for("login"))
 
@@ -537,7 +1138,9 @@ def forgot_password():
         # Always show the same message to prevent email enumeration
         flash("If that email is registered, a reset link has been sent.", "info")
 
-        user = User.query.filter_by(email=email).first()
+        user = db.session.execute(
+            db.select(User).where(User.email == email)
+        ).scalar_one_or_none()
         if user and user.is_active_user:
             token = user.generate_reset_token()
             db.session.commit()
@@ -545,14 +1148,9 @@ def forgot_password():
             send_notification(
                 subject="Vehicle Request Tracker – Password Reset",
                 recipients=[user.email],
-                body=(
-                    f"Hello {user.full_name},\n\n"
-                    f"A password reset was requested for your account ({user.username}).\n\n"
-                    f"Click the link below to reset your password (valid for 24 hours):\n"
-                    f"{reset_url}\n\n"
-                    f"If you did not request this, please ignore this email.\n\n"
-                    f"— Vehicle Request Tracker"
-                ),
+                body=PASSWORD_RESET_EMAIL.format_map({
+                    "name": user.full_name, "username": user.username, "reset_url": reset_url,
+                }),
             )
         return redirect(url_for("login"))
 
@@ -603,10 +1201,14 @@ def reset_password(token):
 @role_required("admin")
 def user_list():
     page = request.args.get("page", 1, type=int)
-    pagination = User.query.order_by(User.full_name).paginate(
-        page=page, per_page=PER_PAGE, error_out=False
-    )
-    return render_template("auth/user_list.html", users=pagination.items, pagination=pagination)
+
+    def render():
+        pagination = User.query.order_by(User.full_name).paginate(
+            page=page, per_page=PER_PAGE, error_out=False
+        )
+        return render_template("auth/user_list.html", users=pagination.items, pagination=pagination)
+
+    return render_conditional(User, render)
 
 
 @app.route("/users/<int:user_id>/edit", methods=["GET", "POST"])
@@ -623,13 +1225,16 @@ def user_edit(user_id):
 
         if not full_name:
             errors.append("Full name is required.")
-        if not email or "@" not in email:
+        # Addresses stored before EMAIL_RE was tightened stay editable as-is
+        if not email or (email != user.email and not EMAIL_RE.match(email)):
             errors.append("A valid email is required.")
 
         # Check email uniqueness (exclude this user)
-        existing = User.query.filter(User.email == email, User.id != user.id).first()
-        if existing:
-            errors.append(f"Email '{email}' is already used by {existing.username}.")
+        owner = db.session.execute(
+            db.select(User.username).where(User.email == email, User.id != user.id)
+        ).scalar()
+        if owner:
+            errors.append(f"Email '{email}' is already used by {owner}.")
 
         # Valid role
         if role not in ("admin", "driver", "requester"):
@@ -651,8 +1256,13 @@ def user_edit(user_id):
         user.email = email
         user.role = role
         user.is_active_user = is_active
-        db.session.commit()
         log_action("edit", "User", user.id, f"Updated user '{user.username}': name={full_name}, email={email}, role={role}, active={is_active}")
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash(f"Email '{email}' is already in use.", "danger")
+            return render_template("auth/user_edit.html", user=user)
         flash(f"User {user.username} updated.", "success")
         return redirect(url_for("user_list"))
     return render_template("auth/user_edit.html", user=user)
@@ -669,8 +1279,8 @@ def admin_reset_password(user_id):
         return redirect(url_for("user_edit", user_id=user.id))
     user.set_password(new_pw)
     user.must_change_password = True
-    db.session.commit()
     log_action("edit", "User", user.id, f"Admin reset password for '{user.username}' (forced change)")
+    db.session.commit()
     flash(f"Password for {user.username} has been reset. They will be asked to change it on next login.", "success")
     return redirect(url_for("user_edit", user_id=user.id))
 
@@ -683,15 +1293,15 @@ def user_delete(user_id):
         flash("You cannot delete your own account.", "danger")
         return redirect(url_for("user_list"))
     # Soft-delete associated bookings & trips
-    for booking in user.bookings_requested:
-        booking.soft_delete()
+    Booking.soft_delete_where(Booking.requester_id == user.id)
     # Unassign from bookings where user was driver
-    for booking in user.bookings_driven:
-        booking.driver_id = None
+    db.session.execute(
+        db.update(Booking).where(Booking.driver_id == user.id).values(driver_id=None)
+    )
     username_deleted = user.username
     user.is_active_user = False
-    db.session.commit()
     log_action("delete", "User", user_id, f"Deactivated user '{username_deleted}' and archived associated records")
+    db.session.commit()
     flash(f"User '{username_deleted}' has been deactivated and their records archived.", "success")
     return redirect(url_for("user_list"))
 
@@ -710,14 +1320,9 @@ def profile():
         errors = []
         if not full_name:
             errors.append("Full name is required.")
-        if not email or "@" not in email or "." not in email.split("@")[-1]:
+        if not email or (email != current_user.email and not EMAIL_RE.match(email)):
             errors.append("A valid email is required.")
 
-        # Email uniqueness (exclude current user)
-        existing = User.query.filter(User.email == email, User.id != current_user.id).first()
-        if existing:
-            errors.append(f"Email '{email}' is already used by another account.")
-
         if errors:
             for e in errors:
                 flash(e, "danger")
@@ -725,8 +1330,14 @@ def profile():
 
         current_user.full_name = full_name
         current_user.email = email
-        db.session.commit()
         log_action("edit", "User", current_user.id, f"Updated own profile: name={full_name}, email={email}")
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # users.email is unique, so the database does the uniqueness check
+            db.session.rollback()
+            flash(f"Email '{email}' is already used by another account.", "danger")
+            return render_template("auth/profile.html")
         flash("Profile updated successfully.", "success")
         return redirect(url_for("profile"))
 
@@ -742,12 +1353,22 @@ def profile():
 @login_required
 def dashboard():
     """Home page – quick stats and upcoming approved bookings."""
-    vehicle_count = Vehicle.query.filter_by(is_deleted=False).count()
-    pending_count = Booking.query.filter_by(status="pending", is_deleted=False).count()
-    maintenance_due = MaintenanceRecord.query.filter_by(status="scheduled", is_deleted=False).count()
+    now = datetime.now()
+    upcoming_criteria = (
+        Booking.status == "approved",
+        Booking.is_deleted == False,
+        Booking.end_datetime_planned >= now,  # still running or yet to start
+    )
+
+    vehicle_count, pending_count, maintenance_due, upcoming_count = get_dashboard_counts(
+        upcoming_criteria
+    )
+
     upcoming = (
-        Booking.query.filter_by(status="approved", is_deleted=False)
+        Booking.query.options(selectinload(Booking.vehicle))
+        .filter(*upcoming_criteria)
         .order_by(Booking.start_datetime_planned)
+        .limit(DASHBOARD_UPCOMING_LIMIT)
         .all()
     )
     return render_template(
@@ -756,6 +1377,7 @@ def dashboard():
         pending_count=pending_count,
         maintenance_due=maintenance_due,
         upcoming=upcoming,
+        upcoming_count=upcoming_count,
     )
 
 
@@ -768,10 +1390,21 @@ def dashboard():
 @login_required
 def vehicle_list():
     page = request.args.get("page", 1, type=int)
-    pagination = Vehicle.query.filter_by(is_deleted=False).order_by(Vehicle.registration_number).paginate(
-        page=page, per_page=PER_PAGE, error_out=False
-    )
-    return render_template("vehicles/list.html", vehicles=pagination.items, pagination=pagination)
+
+    def render():
+        pagination = Vehicle.query.filter_by(is_deleted=False).order_by(Vehicle.registration_number).paginate(
+            page=page, per_page=PER_PAGE, error_out=False
+        )
+        return render_template("vehicles/list.html", vehicles=pagination.items, pagination=pagination)
+
+    return render_conditional(Vehicle, render)
+
+
+def duplicate_registration_message(reg):
+    """Flash text for a registration number the unique constraint rejected."""
+    if record_exists(Vehicle.registration_number == reg, Vehicle.is_deleted == True):
+        return f"Registration number '{reg}' belongs to an archived vehicle."
+    return f"Registration number '{reg}' already exists."
 
 
 @app.route("/vehicles/add", methods=["GET", "POST"])
@@ -795,10 +1428,6 @@ def vehicle_add():
         if status not in ("available", "maintenance"):
             errors.append("Invalid vehicle status.")
 
-        # Uniqueness
-        if reg and Vehicle.query.filter_by(registration_number=reg, is_deleted=False).first():
-            errors.append(f"Registration number '{reg}' already exists.")
-
         if errors:
             for e in errors:
                 flash(e, "danger")
@@ -811,8 +1440,14 @@ def vehicle_add():
             status=status,
         )
         db.session.add(v)
-        db.session.commit()
+        try:
+            db.session.flush()  # assigns v.id for the audit entry
+        except IntegrityError:
+            db.session.rollback()
+            flash(duplicate_registration_message(reg), "danger")
+            return render_template("vehicles/add.html")
         log_action("create", "Vehicle", v.id, f"Registered vehicle '{reg}' ({make} {model})")
+        db.session.commit()
         flash("Vehicle registered successfully.", "success")
         return redirect(url_for("vehicle_list"))
     return render_template("vehicles/add.html")
@@ -840,15 +1475,6 @@ def vehicle_edit(vehicle_id):
         if status not in ("available", "in_use", "maintenance"):
             errors.append("Invalid vehicle status.")
 
-        # Uniqueness (exclude this vehicle)
-        if reg:
-            dup = Vehicle.query.filter(
-                Vehicle.registration_number == reg, Vehicle.id != vehicle.id,
-                Vehicle.is_deleted == False
-            ).first()
-            if dup:
-                errors.append(f"Registration number '{reg}' is already used by another vehicle.")
-
         if errors:
             for e in errors:
                 flash(e, "danger")
@@ -858,8 +1484,13 @@ def vehicle_edit(vehicle_id):
         vehicle.make = make
         vehicle.model = model
         vehicle.status = status
-        db.session.commit()
         log_action("edit", "Vehicle", vehicle.id, f"Updated vehicle '{reg}': make={make}, model={model}, status={status}")
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash(duplicate_registration_message(reg), "danger")
+            return render_template("vehicles/edit.html", vehicle=vehicle)
         flash("Vehicle updated.", "success")
         return redirect(url_for("vehicle_list"))
     return render_template("vehicles/edit.html", vehicle=vehicle)
@@ -871,9 +1502,10 @@ def vehicle_delete(vehicle_id):
     vehicle = db.get_or_404(Vehicle, vehicle_id)
     # Soft-delete vehicle and all associated records
     vehicle.soft_delete()
+    reg = vehicle.registration_number
+    log_action("delete", "Vehicle", vehicle_id, f"Archived vehicle '{reg}' and all associated records")
     db.session.commit()
-    log_action("delete", "Vehicle", vehicle_id, f"Archived vehicle '{vehicle.registration_number}' and all associated records")
-    flash(f"Vehicle '{vehicle.registration_number}' and all associated records have been archived.", "success")
+    flash(f"Vehicle '{reg}' and all associated records have been archived.", "success")
     return redirect(url_for("vehicle_list"))
 
 
@@ -882,32 +1514,55 @@ def vehicle_delete(vehicle_id):
 # ╚═══════════════════════════════════════════════════════════════════════════╝
 
 
+def get_booking_or_404(booking_id):
+    """Load a booking with its vehicle, requester, driver and trip in one query."""
+    booking = db.session.execute(
+        db.select(Booking)
+        .options(
+            joinedload(Booking.vehicle),
+            joinedload(Booking.requester),
+            joinedload(Booking.driver),
+            joinedload(Booking.trip),
+        )
+        .where(Booking.id == booking_id)
+    ).scalar_one_or_none()
+    if booking is None:
+        abort(404)
+    return booking
+
+
 @app.route("/bookings")
 @login_required
 def booking_list():
     status_filter = request.args.get("status", "")
-    page = request.args.get("page", 1, type=int)
-    query = Booking.query.filter_by(is_deleted=False)
+    # Eager-load vehicles so the list renders without one SELECT per row
+    query = Booking.query.options(selectinload(Booking.vehicle)).filter_by(is_deleted=False)
     if status_filter:
         query = query.filter_by(status=status_filter)
-    pagination = query.order_by(Booking.start_datetime_planned.desc()).paginate(
-        page=page, per_page=PER_PAGE, error_out=False
-    )
+
+    bookings, newer, older = keyset_page(query, Booking.start_datetime_planned, Booking.id)
     return render_template(
         "bookings/list.html",
-        bookings=pagination.items,
-        pagination=pagination,
+        bookings=bookings,
+        newer=newer,
+        older=older,
         current_status=status_filter,
     )
 
 
+def _render_booking_add(form):
+    """Render the booking form; the pickers are only loaded when needed."""
+    return render_template(
+        "bookings/add.html", vehicles=vehicle_choices(), drivers=driver_choices(),
+        form=form,
+    )
+
+
 @app.route("/bookings/add", methods=["GET", "POST"])
 @login_required
 def booking_add():
-    vehicles = Vehicle.query.filter_by(is_deleted=False).order_by(Vehicle.registration_number).all()
-    drivers = User.query.filter_by(role="driver", is_active_user=True).order_by(User.full_name).all()
-
     if request.method == "POST":
+        now = datetime.now()
         errors = []
 
         # ── Parse & validate required fields ──────────────────────────
@@ -918,24 +1573,16 @@ def booking_add():
         if not vehicle_id:
             errors.append("Please select a vehicle.")
 
-        start_raw = request.form.get("start_datetime_planned", "")
-        end_raw = request.form.get("end_datetime_planned", "")
-        start_dt = end_dt = None
-        if not start_raw:
-            errors.append("Planned start date/time is required.")
-        else:
-            try:
-                start_dt = datetime.fromisoformat(start_raw)
-            except ValueError:
-                errors.append("Invalid start date/time format.")
-
-        if not end_raw:
-            errors.append("Planned end date/time is required.")
-        else:
-            try:
-                end_dt = datetime.fromisoformat(end_raw)
-            except ValueError:
-                errors.append("Invalid end date/time format.")
+        start_dt = form_field(
+            errors, "start_datetime_planned", datetime.fromisoformat,
+            invalid="Invalid start date/time format.",
+            required="Planned start date/time is required.",
+        )
+        end_dt = form_field(
+            errors, "end_datetime_planned", datetime.fromisoformat,
+            invalid="Invalid end date/time format.",
+            required="Planned end date/time is required.",
+        )
 
         route_from = request.form.get("route_from", "").strip()
         route_to = request.form.get("route_to", "").strip()
@@ -952,38 +1599,53 @@ def booking_add():
         if start_dt and end_dt:
             if end_dt <= start_dt:
                 errors.append("End date/time must be after start date/time.")
-            if start_dt < datetime.now():
+            if start_dt < now:
                 errors.append("Start date/time cannot be in the past.")
 
-        # ── Vehicle status check ──────────────────────────────────────
+        # ── Vehicle status + conflict check (one query) ───────────────
+        # The conflict lookup runs independently of the other errors.
         if vehicle_id:
-            veh = db.session.get(Vehicle, vehicle_id)
-            if not veh:
-                errors.append("Selected vehicle does not exist.")
-            elif veh.status == "maintenance":
-                errors.append(
-                    f"Vehicle {veh.registration_number} is currently under maintenance "
-                    f"and cannot be booked."
-                )
-
-        # ── Conflict check (runs independently of other errors) ─────────
-        if vehicle_id and start_dt and end_dt:
-            conflict = check_booking_conflict(vehicle_id, start_dt, end_dt)
-            if conflict:
-                errors.append(
-                    f"This vehicle is already booked between "
-                    f"{conflict.start_datetime_planned.strftime('%Y-%m-%d %H:%M')} and "
-                    f"{conflict.end_datetime_planned.strftime('%Y-%m-%d %H:%M')} "
-                    f"(Booking #{conflict.id} by {conflict.requester_name})."
+            if not errors:
+                # The check and the insert below must not interleave with
+                # another request booking the same vehicle
+                try:
+                    lock_vehicle_bookings(vehicle_id)
+                except OperationalError:
+                    db.session.rollback()
+                    flash("Another change to this vehicle is being saved – please try again.", "warning")
+                    return _render_booking_add(request.form)
+            if start_dt and end_dt:
+                conflict_id = (
+                    db.select(Booking.id)
+                    .where(*booking_conflict_criteria(vehicle_id, start_dt, end_dt))
+                    .limit(1)
+                    .scalar_subquery()
                 )
+            else:
+                conflict_id = db.null()
+            row = db.session.execute(
+                db.select(Vehicle.registration_number, Vehicle.status, conflict_id)
+                .where(Vehicle.id == vehicle_id)
+            ).first()
+            if row is None:
+                errors.append("Selected vehicle does not exist.")
+            else:
+                reg, veh_status, conflict_id = row
+                if veh_status == "maintenance":
+                    errors.append(
+                        f"Vehicle {reg} is currently under maintenance "
+                        f"and cannot be booked."
+                    )
+                if conflict_id is not None:
+                    errors.append(
+                        booking_conflict_message(db.session.get(Booking, conflict_id))
+                    )
 
         if errors:
+            db.session.rollback()  # releases the vehicle lock, if taken
             for e in errors:
                 flash(e, "danger")
-            return render_template(
-                "bookings/add.html", vehicles=vehicles, drivers=drivers,
-                form=request.form,
-            )
+            return _render_booking_add(request.form)
 
         driver_id = request.form.get("driver_id") if current_user.is_admin else None
         booking = Booking(
@@ -1001,72 +1663,39 @@ def booking_add():
             status="pending",
         )
         db.session.add(booking)
-        db.session.flush()  # assign ID before re-checking
-
-        # Double-check for conflicts after flush to reduce race window
-        conflict = check_booking_conflict(vehicle_id, start_dt, end_dt, exclude_booking_id=booking.id)
-        if conflict:
-            db.session.rollback()
-            flash(
-                f"This vehicle is already booked between "
-                f"{conflict.start_datetime_planned.strftime('%Y-%m-%d %H:%M')} and "
-                f"{conflict.end_datetime_planned.strftime('%Y-%m-%d %H:%M')} "
-                f"(Booking #{conflict.id} by {conflict.requester_name}).",
-                "danger",
-            )
-            return render_template(
-                "bookings/add.html", vehicles=vehicles, drivers=drivers,
-                form=request.form,
-            )
-
-        db.session.commit()
-        log_action("create", "Booking", booking.id, f"Created booking: vehicle={booking.vehicle.registration_number}, route={route_from}→{route_to}")
-        flash("Booking request created (status: pending).", "success")
-
+        db.session.flush()  # assigns booking.id for the audit entry and e-mails
 
         # ── Notify all admins about the new booking request ────────────
-        admins = User.query.filter_by(role="admin", is_active_user=True).all()
-        admin_emails = [a.email for a in admins if a.email]
+        # Built before the commit expires the booking; admins only if mail is on
+        ctx = booking_email_context(booking)
+        outbox = []
+        admin_emails = get_admin_emails() if app.config["MAIL_ENABLED"] else []
         if admin_emails:
-            send_notification(
+            # One message for all admins; Bcc keeps their addresses private
+            outbox.append(dict(
                 subject=f"New Booking Request #{booking.id} – Vehicle Request Tracker",
-                recipients=admin_emails,
-                body=(
-                    f"Hello Admin,\n\n"
-                    f"A new vehicle booking request has been submitted.\n\n"
-                    f"Booking #: {booking.id}\n"
-                    f"Requested by: {booking.requester_name}\n"
-                    f"Vehicle: {booking.vehicle.registration_number}\n"
-                    f"Route: {booking.route_from} → {booking.route_to}\n"
-                    f"Purpose: {booking.purpose}\n"
-                    f"From: {booking.start_datetime_planned.strftime('%d %b %Y %H:%M')}\n"
-                    f"To: {booking.end_datetime_planned.strftime('%d %b %Y %H:%M')}\n\n"
-                    f"Please log in to review and approve/reject this request.\n\n"
-                    f"– Vehicle Request Tracker"
-                ),
-            )
+                recipients=[],
+                bcc=admin_emails,
+                body=EMAIL_TEMPLATES["new_booking_admin"].format_map(ctx),
+            ))
         # ── Confirm to the requester that their request was received ──
         if current_user.email:
-            send_notification(
+            outbox.append(dict(
                 subject=f"Booking Request #{booking.id} Received – Vehicle Request Tracker",
                 recipients=[current_user.email],
-                body=(
-                    f"Hello {current_user.full_name},\n\n"
-                    f"Your vehicle booking request has been submitted successfully.\n\n"
-                    f"Booking #: {booking.id}\n"
-                    f"Vehicle: {booking.vehicle.registration_number}\n"
-                    f"Route: {booking.route_from} → {booking.route_to}\n"
-                    f"From: {booking.start_datetime_planned.strftime('%d %b %Y %H:%M')}\n"
-                    f"To: {booking.end_datetime_planned.strftime('%d %b %Y %H:%M')}\n\n"
-                    f"Status: PENDING – awaiting admin approval.\n"
-                    f"You will receive another email once your request is approved or cancelled.\n\n"
-                    f"– Vehicle Request Tracker"
+                body=EMAIL_TEMPLATES["new_booking_requester"].format_map(
+                    {**ctx, "name": current_user.full_name}
                 ),
-            )
+            ))
+
+        log_action("create", "Booking", booking.id, f"Created booking: vehicle={ctx['vehicle']}, route={route_from}→{route_to}")
+        db.session.commit()
+        flash("Booking request created (status: pending).", "success")
+        send_notifications(outbox)
 
         return redirect(url_for("booking_list"))
 
-    return render_template("bookings/add.html", vehicles=vehicles, drivers=drivers, form={})
+    return _render_booking_add({})
 
 
 @app.route("/api/check-conflict")
@@ -1089,8 +1718,8 @@ def api_check_conflict():
             conflict=True,
             message=(
                 f"This vehicle is already booked from "
-                f"{conflict.start_datetime_planned.strftime('%d %b %Y %H:%M')} to "
-                f"{conflict.end_datetime_planned.strftime('%d %b %Y %H:%M')} "
+                f"{format_datetime(conflict.start_datetime_planned)} to "
+                f"{format_datetime(conflict.end_datetime_planned)} "
                 f"(Booking #{conflict.id} by {conflict.requester_name})."
             ),
         )
@@ -1100,8 +1729,8 @@ def api_check_conflict():
 @app.route("/bookings/<int:booking_id>")
 @login_required
 def booking_detail(booking_id):
-    booking = db.get_or_404(Booking, booking_id)
-    drivers = User.query.filter_by(role="driver", is_active_user=True).order_by(User.full_name).all()
+    booking = get_booking_or_404(booking_id)
+    drivers = driver_choices()
     return render_template("bookings/detail.html", booking=booking, drivers=drivers)
 
 
@@ -1109,9 +1738,24 @@ def booking_detail(booking_id):
 @role_required("admin")
 def booking_approve(booking_id):
     """Approve a pending booking – but only if there is NO overlap conflict."""
-    booking = db.get_or_404(Booking, booking_id)
+    vehicle_id = db.session.execute(
+        db.select(Booking.vehicle_id).where(Booking.id == booking_id)
+    ).scalar_one_or_none()
+    if vehicle_id is None:
+        abort(404)
+
+    # Two admins approving overlapping bookings at once must not both pass
+    # the conflict check: take the write lock, then read the booking.
+    try:
+        lock_vehicle_bookings(vehicle_id)
+    except OperationalError:
+        db.session.rollback()
+        flash("Another change to this vehicle is being saved – please try again.", "warning")
+        return redirect(url_for("booking_detail", booking_id=booking_id))
+    booking = get_booking_or_404(booking_id)
 
     if booking.status != "pending":
+        db.session.rollback()
         flash("Only pending bookings can be approved.", "warning")
         return redirect(url_for("booking_detail", booking_id=booking.id))
 
@@ -1124,89 +1768,87 @@ def booking_approve(booking_id):
     )
     if conflict:
         flash(
-            f"Cannot approve – this vehicle is already booked between "
-            f"{conflict.start_datetime_planned.strftime('%Y-%m-%d %H:%M')} and "
-            f"{conflict.end_datetime_planned.strftime('%Y-%m-%d %H:%M')} "
-            f"(Booking #{conflict.id} by {conflict.requester_name}).",
+            booking_conflict_message(conflict, "Cannot approve – this vehicle"),
             "danger",
         )
+        db.session.rollback()
         return redirect(url_for("booking_detail", booking_id=booking.id))
 
     booking.status = "approved"
-    db.session.commit()
-    log_action("approve", "Booking", booking.id, f"Approved booking #{booking.id} for vehicle {booking.vehicle.registration_number}")
-    flash("Booking approved.", "success")
 
-    # ── Send notification email ───────────────────────────────────────
+    # ── Notification emails ───────────────────────────────────────────
+    # Built before the commit, which would expire the eager-loaded relations
+    ctx = booking_email_context(booking)
+    outbox = []
     if booking.requester and booking.requester.email:
-        send_notification(
+        outbox.append(dict(
             subject=f"Booking #{booking.id} Approved – Vehicle Request Tracker",
             recipients=[booking.requester.email],
-            body=(
-                f"Hello {booking.requester_name},\n\n"
-                f"Your vehicle booking #{booking.id} has been approved.\n\n"
-                f"Vehicle: {booking.vehicle.registration_number}\n"
-                f"Route: {booking.route_from} → {booking.route_to}\n"
-                f"From: {booking.start_datetime_planned.strftime('%d %b %Y %H:%M')}\n"
-                f"To: {booking.end_datetime_planned.strftime('%d %b %Y %H:%M')}\n\n"
-                f"– Vehicle Request Tracker"
+            body=EMAIL_TEMPLATES["approved_requester"].format_map(
+                {**ctx, "name": booking.requester_name}
             ),
-        )
+        ))
     # Also notify driver if assigned
     if booking.driver and booking.driver.email:
-        send_notification(
+        outbox.append(dict(
             subject=f"You have been assigned to Booking #{booking.id}",
             recipients=[booking.driver.email],
-            body=(
-                f"Hello {booking.driver.full_name},\n\n"
-                f"You have been assigned as driver for booking #{booking.id}.\n\n"
-                f"Vehicle: {booking.vehicle.registration_number}\n"
-                f"Route: {booking.route_from} → {booking.route_to}\n"
-                f"From: {booking.start_datetime_planned.strftime('%d %b %Y %H:%M')}\n"
-                f"To: {booking.end_datetime_planned.strftime('%d %b %Y %H:%M')}\n\n"
-                f"– Vehicle Request Tracker"
+            body=EMAIL_TEMPLATES["driver_assigned"].format_map(
+                {**ctx, "name": booking.driver.full_name}
             ),
-        )
+        ))
+
+    log_action("approve", "Booking", booking_id, f"Approved booking #{booking_id} for vehicle {ctx['vehicle']}")
+    db.session.commit()
+    flash("Booking approved.", "success")
+    send_notifications(outbox)
 
-    return redirect(url_for("booking_detail", booking_id=booking.id))
+    return redirect(url_for("booking_detail", booking_id=booking_id))
 
 
 @app.route("/bookings/<int:booking_id>/assign-driver", methods=["POST"])
 @role_required("admin")
 def booking_assign_driver(booking_id):
     """Assign or change the driver for a booking."""
-    booking = db.get_or_404(Booking, booking_id)
-    driver_id = request.form.get("driver_id")
-    booking.driver_id = int(driver_id) if driver_id else None
-    db.session.commit()
-
-    if booking.driver:
-        log_action("assign", "Booking", booking.id, f"Assigned driver '{booking.driver.full_name}' to booking #{booking.id}")
-        flash(f"Driver assigned: {booking.driver.full_name}.", "success")
-        # Notify the driver
-        send_notification(
-            subject=f"Driver Assignment – Booking #{booking.id}",
-            recipients=[booking.driver.email],
-            body=(
-                f"Hello {booking.driver.full_name},\n\n"
-                f"You have been assigned as driver for booking #{booking.id}.\n"
-                f"Vehicle: {booking.vehicle.registration_number}\n"
-                f"Route: {booking.route_from} → {booking.route_to}\n"
-                f"From: {booking.start_datetime_planned.strftime('%d %b %Y %H:%M')}\n"
-                f"To: {booking.end_datetime_planned.strftime('%d %b %Y %H:%M')}\n\n"
-                f"– Vehicle Request Tracker"
+    booking = get_booking_or_404(booking_id)
+    driver_id = request.form.get("driver_id", "").strip()
+    driver = None
+    if driver_id:  # blank means "remove the driver"
+        try:
+            driver = db.session.get(User, int(driver_id))
+        except ValueError:
+            pass
+        if driver is None or driver.role != "driver" or not driver.is_active_user:
+            flash("Please select an active driver.", "danger")
+            return redirect(url_for("booking_detail", booking_id=booking_id))
+    booking.driver = driver
+
+    if driver:
+        # Read everything needed before the commit expires the loaded rows
+        name = driver.full_name
+        notification = dict(
+            subject=f"Driver Assignment – Booking #{booking_id}",
+            recipients=[driver.email],
+            body=EMAIL_TEMPLATES["driver_assigned"].format_map(
+                {**booking_email_context(booking), "name": name}
             ),
         )
+        log_action("assign", "Booking", booking_id, f"Assigned driver '{name}' to booking #{booking_id}")
+        db.session.commit()
+        flash(f"Driver assigned: {name}.", "success")
+        # Notify the driver
+        send_notification(**notification)
     else:
+        db.session.commit()
         flash("Driver removed from booking.", "info")
 
-    return redirect(url_for("booking_detail", booking_id=booking.id))
+    return redirect(url_for("booking_detail", booking_id=booking_id))
 
 
 @app.route("/bookings/<int:booking_id>/cancel", methods=["POST"])
 @login_required
 def booking_cancel(booking_id):
-    booking = db.get_or_404(Booking, booking_id)
+    booking = get_booking_or_404(booking_id)
 
     # Only the booking owner or an admin can cancel
     if not current_user.is_admin and booking.requester_id != current_user.id:
@@ -1215,57 +1857,53 @@ def booking_cancel(booking_id):
 
     if booking.status in ("pending", "approved"):
         booking.status = "cancelled"
-        db.session.commit()
-        log_action("cancel", "Booking", booking.id, f"Cancelled booking #{booking.id} for vehicle {booking.vehicle.registration_number}")
-        flash("Booking cancelled.", "info")
 
+        # Notifications are built before the commit expires the loaded relations
+        ctx = booking_email_context(booking)
+        outbox = []
         # ── Notify the requester that their booking was cancelled ─────
         if booking.requester and booking.requester.email:
             cancelled_by = current_user.full_name
-            send_notification(
+            outbox.append(dict(
                 subject=f"Booking #{booking.id} Cancelled – Vehicle Request Tracker",
                 recipients=[booking.requester.email],
-                body=(
-                    f"Hello {booking.requester_name},\n\n"
-                    f"Your vehicle booking #{booking.id} has been cancelled"
-                    f"{' by ' + cancelled_by if cancelled_by != booking.requester_name else ''}.\n\n"
-                    f"Vehicle: {booking.vehicle.registration_number}\n"
-                    f"Route: {booking.route_from} → {booking.route_to}\n"
-                    f"From: {booking.start_datetime_planned.strftime('%d %b %Y %H:%M')}\n"
-                    f"To: {booking.end_datetime_planned.strftime('%d %b %Y %H:%M')}\n\n"
-                    f"If you have questions, please contact the admin.\n\n"
-                    f"– Vehicle Request Tracker"
-                ),
-            )
+                body=EMAIL_TEMPLATES["cancelled_requester"].format_map({
+                    **ctx,
+                    "name": booking.requester_name,
+                    "cancelled_by": (
+                        f" by {cancelled_by}"
+                        if cancelled_by != booking.requester_name else ""
+                    ),
+                }),
+            ))
         # ── Notify assigned driver if any ─────────────────────────────
         if booking.driver and booking.driver.email:
-            send_notification(
+            outbox.append(dict(
                 subject=f"Booking #{booking.id} Cancelled – Vehicle Request Tracker",
                 recipients=[booking.driver.email],
-                body=(
-                    f"Hello {booking.driver.full_name},\n\n"
-                    f"Booking #{booking.id} you were assigned to has been cancelled.\n\n"
-                    f"Vehicle: {booking.vehicle.registration_number}\n"
-                    f"Route: {booking.route_from} → {booking.route_to}\n"
-                    f"From: {booking.start_datetime_planned.strftime('%d %b %Y %H:%M')}\n"
-                    f"To: {booking.end_datetime_planned.strftime('%d %b %Y %H:%M')}\n\n"
-                    f"– Vehicle Request Tracker"
+                body=EMAIL_TEMPLATES["cancelled_driver"].format_map(
+                    {**ctx, "name": booking.driver.full_name}
                 ),
-            )
+            ))
+
+        log_action("cancel", "Booking", booking_id, f"Cancelled booking #{booking_id} for vehicle {ctx['vehicle']}")
+        db.session.commit()
+        flash("Booking cancelled.", "info")
+        send_notifications(outbox)
     else:
         flash("This booking cannot be cancelled.", "warning")
-    return redirect(url_for("booking_detail", booking_id=booking.id))
+    return redirect(url_for("booking_detail", booking_id=booking_id))
 
 
 @app.route("/bookings/<int:booking_id>/delete", methods=["POST"])
 @role_required("admin")
 def booking_delete(booking_id):
-    booking = db.get_or_404(Booking, booking_id)
+    booking = get_booking_or_404(booking_id)
     vehicle_reg = booking.vehicle.registration_number
     # Soft-delete booking and associated trip
     booking.soft_delete()
-    db.session.commit()
     log_action("delete", "Booking", booking_id, f"Archived booking #{booking_id} ({vehicle_reg})")
+    db.session.commit()
     flash(f"Booking #{booking_id} ({vehicle_reg}) has been archived.", "success")
     return redirect(url_for("booking_list"))
 
@@ -1283,7 +1921,7 @@ def trip_start(booking_id):
         flash("Only admins and drivers can start a trip.", "danger")
         return redirect(url_for("booking_detail", booking_id=booking_id))
 
-    booking = db.get_or_404(Booking, booking_id)
+    booking = get_booking_or_404(booking_id)
 
     if booking.status != "approved":
         flash("Only approved bookings can start a trip.", "warning")
@@ -1308,40 +1946,23 @@ def trip_start(booking_id):
     if request.method == "POST":
         errors = []
 
-        start_raw = request.form.get("start_actual_datetime", "")
-        odo_raw = request.form.get("odometer_start", "")
-        fuel_level_raw = request.form.get("fuel_level_start", "").strip()
-
-        start_dt = None
-        if not start_raw:
-            errors.append("Start date/time is required.")
-        else:
-            try:
-                start_dt = datetime.fromisoformat(start_raw)
-            except ValueError:
-                errors.append("Invalid start date/time format.")
-
-        odometer_start = None
-        if not odo_raw:
-            errors.append("Odometer reading is required.")
-        else:
-            try:
-                odometer_start = int(odo_raw)
-                if odometer_start < 0:
-                    errors.append("Odometer reading cannot be negative.")
-            except ValueError:
-                errors.append("Odometer reading must be a whole number.")
-
-        fuel_level_start = None
-        if not fuel_level_raw:
-            errors.append("Fuel level is required.")
-        else:
-            try:
-                fuel_level_start = float(fuel_level_raw)
-                if fuel_level_start < 0:
-                    errors.append("Fuel level cannot be negative.")
-            except ValueError:
-                errors.append("Fuel level must be a number.")
+        start_dt = form_field(
+            errors, "start_actual_datetime", datetime.fromisoformat,
+            invalid="Invalid start date/time format.",
+            required="Start date/time is required.",
+        )
+        odometer_start = form_field(
+            errors, "odometer_start", int,
+            invalid="Odometer reading must be a whole number.",
+            required="Odometer reading is required.",
+            negative="Odometer reading cannot be negative.",
+        )
+        fuel_level_start = form_field(
+            errors, "fuel_level_start", float,
+            invalid="Fuel level must be a number.",
+            required="Fuel level is required.",
+            negative="Fuel level cannot be negative.",
+        )
 
         if errors:
             for e in errors:
@@ -1357,8 +1978,15 @@ def trip_start(booking_id):
         # Mark vehicle as in use
         booking.vehicle.status = "in_use"
         db.session.add(trip)
-        db.session.commit()
+        try:
+            db.session.flush()  # assigns trip.id for the audit entry
+        except IntegrityError:
+            # A concurrent submit won the race; trips.booking_id is unique
+            db.session.rollback()
+            flash("A trip has already been started for this booking.", "warning")
+            return redirect(url_for("booking_detail", booking_id=booking_id))
         log_action("create", "Trip", trip.id, f"Started trip for booking #{booking.id}, odometer={odometer_start}")
+        db.session.commit()
         flash("Trip started – vehicle marked as in use.", "success")
         return redirect(url_for("booking_detail", booking_id=booking.id))
 
@@ -1373,7 +2001,7 @@ def trip_end(booking_id):
         flash("Only admins and drivers can end a trip.", "danger")
         return redirect(url_for("booking_detail", booking_id=booking_id))
 
-    booking = db.get_or_404(Booking, booking_id)
+    booking = get_booking_or_404(booking_id)
     trip = booking.trip
 
     if trip is None or trip.end_actual_datetime is not None:
@@ -1383,28 +2011,16 @@ def trip_end(booking_id):
     if request.method == "POST":
         errors = []
 
-        end_raw = request.form.get("end_actual_datetime", "")
-        odo_end_raw = request.form.get("odometer_end", "")
-        fuel_level_end_raw = request.form.get("fuel_level_end", "").strip()
-        cost_per_litre_raw = request.form.get("fuel_cost_per_litre", "").strip()
-
-        end_dt = None
-        if not end_raw:
-            errors.append("End date/time is required.")
-        else:
-            try:
-                end_dt = datetime.fromisoformat(end_raw)
-            except ValueError:
-                errors.append("Invalid end date/time format.")
-
-        odometer_end = None
-        if not odo_end_raw:
-            errors.append("Odometer reading is required.")
-        else:
-            try:
-                odometer_end = int(odo_end_raw)
-            except ValueError:
-                errors.append("Odometer reading must be a whole number.")
+        end_dt = form_field(
+            errors, "end_actual_datetime", datetime.fromisoformat,
+            invalid="Invalid end date/time format.",
+            required="End date/time is required.",
+        )
+        odometer_end = form_field(
+            errors, "odometer_end", int,
+            invalid="Odometer reading must be a whole number.",
+            required="Odometer reading is required.",
+        )
 
         # Cross-field checks
         if end_dt and trip.start_actual_datetime and end_dt <= trip.start_actual_datetime:
@@ -1416,37 +2032,26 @@ def trip_end(booking_id):
                 f"odometer ({trip.odometer_start})."
             )
 
-        # Fuel level at end (required)
-        fuel_level_end = None
-        if not fuel_level_end_raw:
-            errors.append("Fuel level at end is required.")
-        else:
-            try:
-                fuel_level_end = float(fuel_level_end_raw)
-                if fuel_level_end < 0:
-                    errors.append("Fuel level cannot be negative.")
-            except ValueError:
-                errors.append("Fuel level must be a number.")
+        fuel_level_end = form_field(
+            errors, "fuel_level_end", float,
+            invalid="Fuel level must be a number.",
+            required="Fuel level at end is required.",
+            negative="Fuel level cannot be negative.",
+        )
 
         # Auto-calculate fuel used from fuel levels
         fuel_used = None
         if fuel_level_end is not None and trip.fuel_level_start is not None:
             fuel_used = round(max(trip.fuel_level_start - fuel_level_end, 0), 1)
 
-        # Cost per litre (optional)
-        fuel_cost = None
-        if cost_per_litre_raw:
-            try:
-                fuel_cost_per_litre = float(cost_per_litre_raw)
-                if fuel_cost_per_litre < 0:
-                    errors.append("Cost per litre cannot be negative.")
-            except ValueError:
-                errors.append("Cost per litre must be a number.")
-                fuel_cost_per_litre = None
-        else:
-            fuel_cost_per_litre = None
+        fuel_cost_per_litre = form_field(
+            errors, "fuel_cost_per_litre", float,
+            invalid="Cost per litre must be a number.",
+            negative="Cost per litre cannot be negative.",
+        )
 
         # Auto-calculate total fuel cost
+        fuel_cost = None
         if fuel_used and fuel_cost_per_litre:
             fuel_cost = round(fuel_used * fuel_cost_per_litre, 2)
 
@@ -1467,8 +2072,8 @@ def trip_end(booking_id):
         # Mark booking completed and vehicle available again
         booking.status = "completed"
         booking.vehicle.status = "available"
-        db.session.commit()
         log_action("complete", "Trip", trip.id, f"Ended trip for booking #{booking.id}, distance={trip.distance} km")
+        db.session.commit()
         flash(
             f"Trip ended – distance: {trip.distance} km. Booking marked as completed.",
             "success",
@@ -1505,7 +2110,7 @@ def maintenance_list():
 @app.route("/maintenance/add", methods=["GET", "POST"])
 @role_required("admin")
 def maintenance_add():
-    vehicles = Vehicle.query.filter_by(is_deleted=False).order_by(Vehicle.registration_number).all()
+    vehicles = vehicle_choices()
     if request.method == "POST":
         errors = []
 
@@ -1524,25 +2129,16 @@ def maintenance_add():
         if not description:
             errors.append("Description is required.")
 
-        sched_raw = request.form.get("scheduled_date", "")
-        sched_date = None
-        if not sched_raw:
-            errors.append("Scheduled date is required.")
-        else:
-            try:
-                sched_date = datetime.strptime(sched_raw, "%Y-%m-%d").date()
-            except ValueError:
-                errors.append("Invalid date format.")
-
-        cost = None
-        cost_raw = request.form.get("cost", "").strip()
-        if cost_raw:
-            try:
-                cost = float(cost_raw)
-                if cost < 0:
-                    errors.append("Cost cannot be negative.")
-            except ValueError:
-                errors.append("Cost must be a number.")
+        sched_date = form_field(
+            errors, "scheduled_date", date.fromisoformat,
+            invalid="Invalid date format.",
+            required="Scheduled date is required.",
+        )
+        cost = form_field(
+            errors, "cost", float,
+            invalid="Cost must be a number.",
+            negative="Cost cannot be negative.",
+        )
 
         if errors:
             for e in errors:
@@ -1559,31 +2155,63 @@ def maintenance_add():
             created_by_id=current_user.id,
         )
         db.session.add(rec)
-        db.session.commit()
+        db.session.flush()  # assigns rec.id for the audit entry
 
         # Optionally set vehicle to maintenance status
         if request.form.get("set_maintenance"):
             rec.vehicle.status = "maintenance"
-            db.session.commit()
 
         log_action("create", "MaintenanceRecord", rec.id, f"Created maintenance ({mtype}) for vehicle {rec.vehicle.registration_number}")
+        db.session.commit()
         flash("Maintenance record created.", "success")
         return redirect(url_for("maintenance_list"))
     return render_template("maintenance/add.html", vehicles=vehicles)
 
 
+def update_maintenance_or_404(rec_id, values):
+    """UPDATE a maintenance record without loading it; return its vehicle_id or 404."""
+    vehicle_id = db.session.execute(
+        db.update(MaintenanceRecord)
+        .where(MaintenanceRecord.id == rec_id)
+        .values(**values)
+        .returning(MaintenanceRecord.vehicle_id)
+    ).scalar_one_or_none()
+    if vehicle_id is None:
+        abort(404)
+    return vehicle_id
+
+
 @app.route("/maintenance/<int:rec_id>/complete", methods=["POST"])
 @role_required("admin")
 def maintenance_complete(rec_id):
-    rec = db.get_or_404(MaintenanceRecord, rec_id)
-    rec.status = "completed"
-    rec.completed_date = datetime.now(timezone.utc).date()
-    if request.form.get("cost"):
-        rec.cost = float(request.form["cost"])
+    errors = []
+    cost = form_field(
+        errors, "cost", float,
+        invalid="Cost must be a number.",
+        negative="Cost cannot be negative.",
+    )
+    if errors:
+        for e in errors:
+            flash(e, "danger")
+        return redirect(url_for("maintenance_list"))
+
+    values = {
+        "status": "completed",
+        # UTC like the templates' today_date; date.today() is server-local
+        "completed_date": datetime.now(timezone.utc).date(),
+    }
+    if cost is not None:
+        values["cost"] = cost
+    vehicle_id = update_maintenance_or_404(rec_id, values)
     # Set vehicle back to available
-    rec.vehicle.status = "available"
+    vehicle_reg = db.session.execute(
+        db.update(Vehicle)
+        .where(Vehicle.id == vehicle_id)
+        .values(status="available")
+        .returning(Vehicle.registration_number)
+    ).scalar_one()
+    log_action("complete", "MaintenanceRecord", rec_id, f"Completed maintenance for vehicle {vehicle_reg}")
     db.session.commit()
-    log_action("complete", "MaintenanceRecord", rec.id, f"Completed maintenance for vehicle {rec.vehicle.registration_number}")
     flash("Maintenance marked as completed. Vehicle is now available.", "success")
     return redirect(url_for("maintenance_list"))
 
@@ -1591,12 +2219,17 @@ def maintenance_complete(rec_id):
 @app.route("/maintenance/<int:rec_id>/cancel", methods=["POST"])
 @role_required("admin")
 def maintenance_cancel(rec_id):
-    rec = db.get_or_404(MaintenanceRecord, rec_id)
-    rec.status = "cancelled"
-    if rec.vehicle.status == "maintenance":
-        rec.vehicle.status = "available"
+    vehicle_id = update_maintenance_or_404(rec_id, {"status": "cancelled"})
+    db.session.execute(
+        db.update(Vehicle)
+        .where(Vehicle.id == vehicle_id, Vehicle.status == "maintenance")
+        .values(status="available")
+    )
+    vehicle_reg = db.session.execute(
+        db.select(Vehicle.registration_number).where(Vehicle.id == vehicle_id)
+    ).scalar_one()
+    log_action("cancel", "MaintenanceRecord", rec_id, f"Cancelled maintenance for vehicle {vehicle_reg}")
     db.session.commit()
-    log_action("cancel", "MaintenanceRecord", rec.id, f"Cancelled maintenance for vehicle {rec.vehicle.registration_number}")
     flash("Maintenance record cancelled.", "info")
     return redirect(url_for("maintenance_list"))
 
@@ -1608,8 +2241,8 @@ def maintenance_delete(rec_id):
     vehicle_reg = rec.vehicle.registration_number
     # Soft-delete maintenance record
     rec.soft_delete()
-    db.session.commit()
     log_action("delete", "MaintenanceRecord", rec_id, f"Archived maintenance record for vehicle '{vehicle_reg}'")
+    db.session.commit()
     flash(f"Maintenance record for '{vehicle_reg}' has been archived.", "success")
     return redirect(url_for("maintenance_list"))
 
@@ -1619,10 +2252,20 @@ def maintenance_delete(rec_id):
 # ╚═══════════════════════════════════════════════════════════════════════════╝
 
 
+def parse_report_range(date_from, date_to):
+    """Turn YYYY-MM-DD strings into an inclusive (start, end) range, or None."""
+    try:
+        day_from = date.fromisoformat(date_from)
+        day_to = date.fromisoformat(date_to)
+    except ValueError:
+        return None
+    return datetime.combine(day_from, time.min), datetime.combine(day_to, REPORT_DAY_END)
+
+
 @app.route("/reports/vehicle", methods=["GET"])
 @login_required
 def vehicle_report():
-    vehicles = Vehicle.query.filter_by(is_deleted=False).order_by(Vehicle.registration_number).all()
+    vehicles = vehicle_choices()
 
     trips = []
     total_distance = 0
@@ -1631,25 +2274,39 @@ def vehicle_report():
     date_from = request.args.get("date_from", "")
     date_to = request.args.get("date_to", "")
 
+    report_range = None
     if selected_vehicle_id and date_from and date_to:
-        dt_from = datetime.fromisoformat(date_from)
-        dt_to = datetime.fromisoformat(date_to + "T23:59:59")
+        report_range = parse_report_range(date_from, date_to)
+        if report_range is None:
+            flash("Please enter valid dates.", "warning")
 
+    if report_range:
+        dt_from, dt_to = report_range
+        criteria = (
+            Booking.vehicle_id == selected_vehicle_id,
+            Trip.start_actual_datetime >= dt_from,
+            Trip.start_actual_datetime <= dt_to,
+            Trip.end_actual_datetime.isnot(None),
+            Trip.is_deleted == False,
+            Booking.is_deleted == False,
+        )
         trips = (
             Trip.query.join(Booking)
-            .filter(
-                Booking.vehicle_id == selected_vehicle_id,
-                Trip.start_actual_datetime >= dt_from,
-                Trip.start_actual_datetime <= dt_to,
-                Trip.end_actual_datetime.isnot(None),
-                Trip.is_deleted == False,
-                Booking.is_deleted == False,
-            )
+            # Reuse the join for trip.booking and pull each driver in alongside
+            .options(contains_eager(Trip.booking).joinedload(Booking.driver))
+            .filter(*criteria)
             .order_by(Trip.start_actual_datetime)
             .all()
         )
-        total_distance = sum(t.distance or 0 for t in trips)
-        total_fuel_cost = sum(t.fuel_cost or 0 for t in trips)
+        # Totals are summed by the database rather than folded in Python
+        total_distance, total_fuel_cost = db.session.execute(
+            db.select(
+                db.func.coalesce(db.func.sum(Trip.distance), 0),
+                db.func.coalesce(db.func.sum(Trip.fuel_cost), 0),
+            )
+            .join(Booking, Trip.booking_id == Booking.id)
+            .where(*criteria)
+        ).one()
 
     return render_template(
         "reports/vehicle_report.html",
@@ -1674,9 +2331,9 @@ def budget_report():
         db.session.query(
             Booking.project_code,
             db.func.count(Trip.id).label("trip_count"),
-            db.func.sum(Trip.distance).label("total_distance"),
-            db.func.sum(Trip.fuel_used).label("total_fuel"),
-            db.func.sum(Trip.fuel_cost).label("total_cost"),
+            db.func.coalesce(db.func.sum(Trip.distance), 0).label("total_distance"),
+            db.func.coalesce(db.func.sum(Trip.fuel_used), 0).label("total_fuel"),
+            db.func.coalesce(db.func.sum(Trip.fuel_cost), 0).label("total_cost"),
         )
         .join(Trip, Trip.booking_id == Booking.id)
         .filter(
@@ -1685,6 +2342,7 @@ def budget_report():
             Booking.is_deleted == False,
         )
         .group_by(Booking.project_code)
+        .order_by(Booking.project_code)
         .all()
     )
     return render_template("reports/budget_report.html", rows=rows)
@@ -1692,6 +2350,18 @@ def budget_report():
 
 # ── Excel export ─────────────────────────────────────────────────────────────
 
+# Minimum widths for columns A–K (write-only sheets can't be auto-sized afterwards)
+EXPORT_COLUMN_WIDTHS = (9, 11, 22, 22, 34, 19, 19, 15, 10, 10, 17)
+EXPORT_MAX_COLUMN_WIDTH = 40
+EXPORT_BATCH_SIZE = 1000
+# Cell styles are immutable value objects, so one set is shared by every export
+EXPORT_TITLE_FONT = Font(bold=True, size=14)
+EXPORT_PERIOD_FONT = Font(size=11, italic=True)
+EXPORT_HEADER_FONT = Font(bold=True, color="FFFFFF")
+EXPORT_HEADER_FILL = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
+EXPORT_HEADER_ALIGN = Alignment(horizontal="center")
+EXPORT_TOTAL_FONT = Font(bold=True)
+
 
 @app.route("/reports/vehicle/export")
 @login_required
@@ -1701,100 +2371,158 @@ def vehicle_report_export():
     date_from = request.args.get("date_from", "")
     date_to = request.args.get("date_to", "")
 
-    if not (selected_vehicle_id and date_from and date_to):
+    report_range = (
+        parse_report_range(date_from, date_to)
+        if selected_vehicle_id and date_from and date_to else None
+    )
+    if report_range is None:
         flash("Please select a vehicle and date range first.", "warning")
         return redirect(url_for("vehicle_report"))
-
-    dt_from = datetime.fromisoformat(date_from)
-    dt_to = datetime.fromisoformat(date_to + "T23:59:59")
+    dt_from, dt_to = report_range
 
     vehicle = db.get_or_404(Vehicle, selected_vehicle_id)
 
-    trips = (
-        Trip.query.join(Booking)
-        .filter(
-            Booking.vehicle_id == selected_vehicle_id,
-            Trip.start_actual_datetime >= dt_from,
-            Trip.start_actual_datetime <= dt_to,
-            Trip.end_actual_datetime.isnot(None),
-            Trip.is_deleted == False,
-            Booking.is_deleted == False,
+    criteria = (
+        Booking.vehicle_id == selected_vehicle_id,
+        Trip.start_actual_datetime >= dt_from,
+        Trip.start_actual_datetime <= dt_to,
+        Trip.end_actual_datetime.isnot(None),
+        Trip.is_deleted == False,
+        Booking.is_deleted == False,
+    )
+
+    # Column widths and totals in one aggregate (write-only sheets can't resize)
+    (longest_requester, longest_driver, longest_route,
+     total_distance, total_fuel, total_cost) = db.session.execute(
+        db.select(
+            db.func.max(db.func.length(Booking.requester_name)),
+            db.func.max(db.func.length(User.full_name)),
+            db.func.max(db.func.length(Booking.route_from) + db.func.length(Booking.route_to)),
+            db.func.coalesce(db.func.sum(Trip.distance), 0),
+            db.func.coalesce(db.func.sum(Trip.fuel_used), 0),
+            db.func.coalesce(db.func.sum(Trip.fuel_cost), 0),
+        )
+        .select_from(Trip)
+        .join(Booking, Trip.booking_id == Booking.id)
+        .outerjoin(User, Booking.driver_id == User.id)
+        .where(*criteria)
+    ).one()
+    widths = list(EXPORT_COLUMN_WIDTHS)
+    for col, length in ((2, longest_requester), (3, longest_driver), (4, longest_route and longest_route + 3)):
+        if length:
+            widths[col] = min(max(widths[col], length + 3), EXPORT_MAX_COLUMN_WIDTH)
+
+    # Plain column tuples streamed in batches: no ORM objects, and the driver
+    # name comes from the join instead of a lazy load per trip
+    trip_rows = db.session.execute(
+        db.select(
+            Trip.id,
+            Booking.id,
+            Booking.requester_name,
+            User.full_name,
+            Booking.route_from,
+            Booking.route_to,
+            Trip.start_actual_datetime,
+            Trip.end_actual_datetime,
+            Trip.distance,
+            Trip.fuel_used,
+            Trip.fuel_cost_per_litre,
+            Trip.fuel_cost,
         )
+        .join(Booking, Trip.booking_id == Booking.id)
+        .outerjoin(User, Booking.driver_id == User.id)
+        .where(*criteria)
         .order_by(Trip.start_actual_datetime)
-        .all()
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
     )
 
-    # Build Excel workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Trip Report"
-
-    # Title row
-    header_font = Font(bold=True, size=14)
-    ws.merge_cells("A1:J1")
-    ws["A1"] = f"Trip Report – {vehicle.registration_number} ({vehicle.make} {vehicle.model})"
-    ws["A1"].font = header_font
-
-    ws.merge_cells("A2:J2")
-    ws["A2"] = f"Period: {date_from} to {date_to}"
-    ws["A2"].font = Font(size=11, italic=True)
+    # Build Excel workbook in write-only mode: rows are streamed to a temp
+    # file as they are appended instead of being held as a grid of Cell objects
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Trip Report")
+
+    # Column widths have to be declared before the first row is written
+    for letter, width in zip("ABCDEFGHIJK", widths):
+        ws.column_dimensions[letter].width = width
+
+    def styled(value, font=None, fill=None, alignment=None):
+        cell = WriteOnlyCell(ws, value=value)
+        if font is not None:
+            cell.font = font
+        if fill is not None:
+            cell.fill = fill
+        if alignment is not None:
+            cell.alignment = alignment
+        return cell
+
+    # Title rows
+    ws.append([styled(
+        f"Trip Report – {vehicle.registration_number} ({vehicle.make} {vehicle.model})",
+        font=EXPORT_TITLE_FONT,
+    )])
+    ws.merged_cells.add("A1:J1")
+    ws.append([styled(f"Period: {date_from} to {date_to}", font=EXPORT_PERIOD_FONT)])
+    ws.merged_cells.add("A2:J2")
+    ws.append([])
 
     # Column headers
     headers = [
         "Trip #", "Booking #", "Requester", "Driver", "Route",
         "Start", "End", "Distance (km)", "Fuel (L)", "Cost/L", "Total Fuel Cost",
     ]
-    header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-    header_font_white = Font(bold=True, color="FFFFFF")
-
-    for col, h in enumerate(headers, 1):
-        cell = ws.cell(row=4, column=col, value=h)
-        cell.font = header_font_white
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal="center")
-
-    # Data rows
-    for i, t in enumerate(trips, 5):
-        ws.cell(row=i, column=1, value=t.id)
-        ws.cell(row=i, column=2, value=t.booking.id)
-        ws.cell(row=i, column=3, value=t.booking.requester_name)
-        ws.cell(
-            row=i, column=4,
-            value=t.booking.driver.full_name if t.booking.driver else "–",
-        )
-        ws.cell(row=i, column=5, value=f"{t.booking.route_from} → {t.booking.route_to}")
-        ws.cell(row=i, column=6, value=t.start_actual_datetime.strftime("%d %b %Y %H:%M"))
-        ws.cell(row=i, column=7, value=t.end_actual_datetime.strftime("%d %b %Y %H:%M"))
-        ws.cell(row=i, column=8, value=t.distance)
-        ws.cell(row=i, column=9, value=t.fuel_used or "")
-        ws.cell(row=i, column=10, value=t.fuel_cost_per_litre or "")
-        ws.cell(row=i, column=11, value=t.fuel_cost or "")
+    ws.append([
+        styled(h, font=EXPORT_HEADER_FONT, fill=EXPORT_HEADER_FILL, alignment=EXPORT_HEADER_ALIGN)
+        for h in headers
+    ])
+
+    # Data rows – plain values, no per-cell objects
+    append, fmt = ws.append, format_datetime
+    for (trip_id, booking_id, requester_name, driver_name, route_from, route_to,
+         start, end, distance, fuel_used, cost_per_litre, fuel_cost) in trip_rows:
+        append((
+            trip_id,
+            booking_id,
+            requester_name,
+            driver_name or "–",
+            f"{route_from} → {route_to}",
+            fmt(start),
+            fmt(end),
+            distance,
+            fuel_used or "",
+            cost_per_litre or "",
+            fuel_cost or "",
+        ))
 
     # Totals row
-    total_row = len(trips) + 5
-    ws.cell(row=total_row, column=7, value="TOTAL").font = Font(bold=True)
-    ws.cell(row=total_row, column=8, value=sum(t.distance or 0 for t in trips)).font = Font(bold=True)
-    ws.cell(row=total_row, column=9, value=sum(t.fuel_used or 0 for t in trips)).font = Font(bold=True)
-    ws.cell(row=total_row, column=10, value="")  # no total for cost/L
-    ws.cell(row=total_row, column=11, value=sum(t.fuel_cost or 0 for t in trips)).font = Font(bold=True)
-
-    # Auto-width columns
-    for col in ws.columns:
-        max_len = max((len(str(cell.value or "")) for cell in col), default=12)
-        ws.column_dimensions[col[0].column_letter].width = min(max_len + 3, 40)
-
-    # Save to bytes buffer
-    buf = io.BytesIO()
-    wb.save(buf)
-    buf.seek(0)
+    bold = EXPORT_TOTAL_FONT
+    ws.append([
+        None, None, None, None, None, None,
+        styled("TOTAL", font=bold),
+        styled(total_distance, font=bold),
+        styled(total_fuel, font=bold),
+        "",  # no total for cost/L
+        styled(total_cost, font=bold),
+    ])
+
+    # Save to an anonymous temp file rather than an in-memory buffer; the
+    # response streams it from disk and the file disappears once it is closed
+    tmp = tempfile.TemporaryFile()
+    try:
+        wb.save(tmp)
+        tmp.seek(0)
+    except Exception:
+        tmp.close()
+        raise
 
     filename = f"trip_report_{vehicle.registration_number}_{date_from}_to_{date_to}.xlsx"
-    return send_file(
-        buf,
+    response = send_file(
+        tmp,
         mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         as_attachment=True,
         download_name=filename,
     )
+    response.content_length = os.fstat(tmp.fileno()).st_size
+    return response
 
 
 # ╔═══════════════════════════════════════════════════════════════════════════╗
@@ -1808,36 +2536,77 @@ def calendar_view():
     return render_template("calendar.html")
 
 
+def calendar_response(body, etag):
+    """Send a serialised calendar feed, or 304 if the client already has it."""
+    response = app.response_class(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
 @app.route("/api/bookings")
 @login_required
 def api_bookings():
-    """Return bookings as JSON events for FullCalendar."""
-    bookings = Booking.query.filter(
+    """Return bookings overlapping FullCalendar's ``?start=&end=`` range as JSON events."""
+    cache_key = (request.args.get("start"), request.args.get("end"))
+    now = _time.monotonic()
+    cached = _calendar_cache.get(cache_key)
+    if cached is not None and cached[0] > now:
+        return calendar_response(*cached[1:])
+
+    criteria = [
         Booking.status.in_(["pending", "approved"]),
-        Booking.is_deleted == False
-    ).all()
-
-    colour_map = {
-        "pending": "#ffc107",   # yellow
-        "approved": "#198754",  # green
-    }
+        Booking.is_deleted == False,
+    ]
+    try:
+        # Planned times are stored as naive local times, so drop any offset
+        start = datetime.fromisoformat(request.args["start"]).replace(tzinfo=None)
+        end = datetime.fromisoformat(request.args["end"]).replace(tzinfo=None)
+    except (KeyError, ValueError):
+        pass
+    else:
+        criteria += [
+            Booking.start_datetime_planned < end,
+            Booking.end_datetime_planned > start,
+        ]
+    rows = db.session.execute(
+        db.select(
+            Booking.id,
+            Vehicle.registration_number,
+            Booking.route_from,
+            Booking.route_to,
+            Booking.start_datetime_planned,
+            Booking.end_datetime_planned,
+            Booking.status,
+        )
+        .join(Vehicle, Booking.vehicle_id == Vehicle.id)
+        .where(*criteria)
+    )
 
     events = []
-    for b in bookings:
+    for booking_id, reg, route_from, route_to, start_dt, end_dt, status in rows:
         # Sanitise user-provided fields for defence-in-depth
-        safe_from = (b.route_from or "").replace("<", "&lt;").replace(">", "&gt;")
-        safe_to = (b.route_to or "").replace("<", "&lt;").replace(">", "&gt;")
+        safe_from = (route_from or "").translate(_HTML_ESCAPE)
+        safe_to = (route_to or "").translate(_HTML_ESCAPE)
         events.append(
             {
-                "id": b.id,
-                "title": f"{b.vehicle.registration_number} – {safe_from}→{safe_to}",
-                "start": b.start_datetime_planned.isoformat(),
-                "end": b.end_datetime_planned.isoformat(),
-                "url": url_for("booking_detail", booking_id=b.id),
-                "color": colour_map.get(b.status, "#6c757d"),
+                "id": booking_id,
+                "title": f"{reg} – {safe_from}→{safe_to}",
+                "start": start_dt.isoformat(),
+                "end": end_dt.isoformat(),
+                "url": url_for("booking_detail", booking_id=booking_id),
+                # The feed only holds pending and approved bookings
+                "color": _COLOR_PENDING if status == "pending" else _COLOR_APPROVED,
             }
         )
-    return jsonify(events)
+
+    body = _calendar_json(events)
+    etag = hashlib.sha256(body.encode()).hexdigest()
+    if len(_calendar_cache) >= CALENDAR_CACHE_MAX:
+        _calendar_cache.clear()
+    _calendar_cache[cache_key] = (now + CALENDAR_CACHE_TTL, body, etag)
+    return calendar_response(body, etag)
 
 
 # ╔═══════════════════════════════════════════════════════════════════════════╗
@@ -1851,7 +2620,6 @@ def audit_log():
     """Show the audit trail of all create / edit / delete actions."""
     entity_filter = request.args.get("entity", "")
     action_filter = request.args.get("action", "")
-    page = request.args.get("page", 1, type=int)
 
     query = AuditLog.query
     if entity_filter:
@@ -1859,13 +2627,12 @@ def audit_log():
     if action_filter:
         query = query.filter_by(action=action_filter)
 
-    pagination = query.order_by(AuditLog.timestamp.desc()).paginate(
-        page=page, per_page=PER_PAGE, error_out=False
-    )
+    logs, newer, older = keyset_page(query, AuditLog.timestamp, AuditLog.id)
     return render_template(
         "audit_log.html",
-        logs=pagination.items,
-        pagination=pagination,
+        logs=logs,
+        newer=newer,
+        older=older,
         current_entity=entity_filter,
         current_action=action_filter,
     )
@@ -1886,12 +2653,15 @@ def analytics_dashboard():
     month_ago = now - timedelta(days=30)
 
     # ── Summary stats ────────────────────────────────────────────────
-    total_views = PageView.query.count()
-    today_views = PageView.query.filter(
-        func.date(PageView.timestamp) == today
-    ).count()
-    week_views = PageView.query.filter(PageView.timestamp >= week_ago).count()
-    month_views = PageView.query.filter(PageView.timestamp >= month_ago).count()
+    # All four view counters from one scan, via filtered aggregates
+    total_views, today_views, week_views, month_views = db.session.execute(
+        db.select(
+            func.count(),
+            func.count().filter(func.date(PageView.timestamp) == today),
+            func.count().filter(PageView.timestamp >= week_ago),
+            func.count().filter(PageView.timestamp >= month_ago),
+        ).select_from(PageView)
+    ).one()
 
     # Unique visitors (by user_id for logged-in, IP for anonymous)
     # Don't count the same person twice: use user_id when available,
@@ -2200,7 +2970,7 @@ def gps_vehicles():
             "heading": latest.heading,
             "accuracy": latest.accuracy,
             "last_update": latest.timestamp.strftime("%d %b %Y %H:%M:%S"),
-            "trip_started": trip.start_actual_datetime.strftime("%d %b %Y %H:%M"),
+            "trip_started": format_datetime(trip.start_actual_datetime),
             "elapsed": elapsed_str,
             "elapsed_seconds": elapsed_seconds,
             "distance_km": round(distance_km, 1),
@@ -2238,6 +3008,8 @@ def gps_trip_trail(trip_id):
 
 
 if __name__ == "__main__":
+    with app.app_context():
+        init_db()
     port = int(os.environ.get("PORT", 5000))
     debug = os.environ.get("FLASK_DEBUG", "1") == "1"
     app.run(host="0.0.0.0", port=port, debug=debug)
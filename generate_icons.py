@@ -47,32 +47,16 @@ SVG_PATH = os.path.join(SCRIPT_DIR, "static", "app-icon.svg")
 ICONS_DIR = os.path.join(SCRIPT_DIR, "static", "icons")
 
 
-def generate_with_cairosvg():
-    """Generate PNG icons using cairosvg (best quality)."""
-    os.makedirs(ICONS_DIR, exist_ok=True)
-
+def save_icons(master):
+    """Write every PNG size and the .ico by downsampling the *master* image."""
     for filename, size in ICON_SIZES.items():
+        resized = master.resize((size, size), Image.LANCZOS)
         output_path = os.path.join(ICONS_DIR, filename)
-        cairosvg.svg2png(
-            url=SVG_PATH,
-            write_to=output_path,
-            output_width=size,
-            output_height=size,
-        )
+        resized.save(output_path, "PNG")
         print(f"  Created {filename} ({size}x{size})")
 
-    # Generate .ico file
-    ico_images = []
-    for size in ICO_SIZES:
-        png_data = cairosvg.svg2png(
-            url=SVG_PATH,
-            output_width=size,
-            output_height=size,
-        )
-        from io import BytesIO
-        img = Image.open(BytesIO(png_data))
-        ico_images.append(img)
-
+    # Generate .ico
+    ico_images = [master.resize((s, s), Image.LANCZOS) for s in ICO_SIZES]
     ico_path = os.path.join(ICONS_DIR, "favicon.ico")
     ico_images[0].save(
         ico_path,
@@ -83,6 +67,25 @@ def generate_with_cairosvg():
     print(f"  Created favicon.ico ({', '.join(f'{s}x{s}' for s in ICO_SIZES)})")
 
 
+def generate_with_cairosvg():
+    """Generate PNG icons using cairosvg (best quality).
+
+    The SVG is rasterised once at the largest size and every other size is
+    downsampled from that, rather than re-parsing and re-rendering per size.
+    """
+    os.makedirs(ICONS_DIR, exist_ok=True)
+
+    from io import BytesIO
+
+    size = max(ICON_SIZES.values())
+    png_data = cairosvg.svg2png(
+        url=SVG_PATH,
+        output_width=size,
+        output_height=size,
+    )
+    save_icons(Image.open(BytesIO(png_data)).convert("RGBA"))
+
+
 def generate_with_pillow_fallback():
     """Fallback: Generate icons from the largest PNG using Pillow resize.
     This requires at least one pre-existing PNG or uses a programmatic icon.
@@ -153,23 +156,7 @@ def generate_with_pillow_fallback():
     tw = bbox[2] - bbox[0]
     draw.text(((size - tw) // 2, 430), text, fill=(255, 255, 255, 220), font=font)
 
-    # Save all sizes
-    for filename, s in ICON_SIZES.items():
-        resized = img.resize((s, s), Image.LANCZOS)
-        output_path = os.path.join(ICONS_DIR, filename)
-        resized.save(output_path, "PNG")
-        print(f"  Created {filename} ({s}x{s})")
-
-    # Generate .ico
-    ico_images = [img.resize((s, s), Image.LANCZOS) for s in ICO_SIZES]
-    ico_path = os.path.join(ICONS_DIR, "favicon.ico")
-    ico_images[0].save(
-        ico_path,
-        format="ICO",
-        sizes=[(s, s) for s in ICO_SIZES],
-        append_images=ico_images[1:],
-    )
-    print(f"  Created favicon.ico ({', '.join(f'{s}x{s}' for s in ICO_SIZES)})")
+    save_icons(img)
 
     return img
 
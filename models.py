@@ -3,6 +3,7 @@ COSME Project – Vehicle Tracker
 SQLAlchemy models for User, Vehicle, Booking, Trip, and MaintenanceRecord.
 """
 
+import functools
 import secrets
 from datetime import datetime, timedelta, timezone
 
@@ -12,12 +13,30 @@ from werkzeug.security import check_password_hash, generate_password_hash
 
 db = SQLAlchemy()
 
+# Pinned so hashes don't silently change if Werkzeug's default moves.
+# scrypt is memory-hard and costs roughly 50 ms per verification.
+PASSWORD_HASH_METHOD = "scrypt"
+
+
+@functools.cache
+def _reference_password_hash():
+    """A throwaway hash made with the current method, built on first use.
+
+    Verified against for unknown usernames so they cost the same as real
+    ones, and its ``method:params`` prefix is what stored hashes should match.
+    """
+    return generate_password_hash(secrets.token_urlsafe(16), method=PASSWORD_HASH_METHOD)
+
 
 # ---------------------------------------------------------------------------
 # User  (authentication + roles)
 # ---------------------------------------------------------------------------
 class User(UserMixin, db.Model):
     __tablename__ = "users"
+    __table_args__ = (
+        # Admin-notification lookup: role="admin" AND is_active_user
+        db.Index("ix_user_role_active", "role", "is_active_user"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -34,6 +53,14 @@ class User(UserMixin, db.Model):
     created_at = db.Column(
         db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc)
     )
+    # Drives the Last-Modified/ETag validators of the user list
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=True,
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+        index=True,
+    )
 
     # Relationships
     bookings_requested = db.relationship(
@@ -44,11 +71,26 @@ class User(UserMixin, db.Model):
     )
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(password, method=PASSWORD_HASH_METHOD)
 
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    def password_needs_rehash(self):
+        """True when the stored hash was made with another method or cost."""
+        current = _reference_password_hash().partition("$")[0]
+        return self.password_hash.partition("$")[0] != current
+
+    @staticmethod
+    def check_password_for_unknown_user(password):
+        """Spend the same hashing work as check_password, then fail.
+
+        Keeps a login for a username that doesn't exist from answering
+        measurably faster than one with a wrong password.
+        """
+        check_password_hash(_reference_password_hash(), password)
+        return False
+
     def generate_reset_token(self, expires_hours=24):
         """Generate a unique password-reset token valid for *expires_hours*."""
         self.password_reset_token = secrets.token_urlsafe(48)
@@ -58,7 +100,9 @@ class User(UserMixin, db.Model):
     @staticmethod
     def verify_reset_token(token):
         """Return the User associated with *token* if it is still valid, else None."""
-        user = User.query.filter_by(password_reset_token=token).first()
+        user = db.session.execute(
+            db.select(User).where(User.password_reset_token == token)
+        ).scalar_one_or_none()
         if user is None:
             return None
         if user.password_reset_expiry is None:
@@ -92,6 +136,14 @@ class User(UserMixin, db.Model):
 # ---------------------------------------------------------------------------
 class Vehicle(db.Model):
     __tablename__ = "vehicles"
+    __table_args__ = (
+        # Booking checks read status directly instead of querying open
+        # maintenance records, so keep it to the values the app writes
+        db.CheckConstraint(
+            "status IN ('available', 'in_use', 'maintenance')",
+            name="ck_vehicle_status",
+        ),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     registration_number = db.Column(db.String(20), unique=True, nullable=False)
@@ -105,6 +157,15 @@ class Vehicle(db.Model):
     is_deleted = db.Column(db.Boolean, nullable=False, default=False)
     deleted_at = db.Column(db.DateTime, nullable=True)
 
+    # Drives the Last-Modified/ETag validators of the vehicle list
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=True,
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+        index=True,
+    )
+
     # Relationships
     bookings = db.relationship("Booking", backref="vehicle", lazy=True)
     maintenance_records = db.relationship(
@@ -113,12 +174,16 @@ class Vehicle(db.Model):
 
     def soft_delete(self):
         """Mark this vehicle and all its associated records as deleted."""
+        now = datetime.now(timezone.utc)
         self.is_deleted = True
-        self.deleted_at = datetime.now(timezone.utc)
-        for rec in self.maintenance_records:
-            rec.soft_delete()
-        for booking in self.bookings:
-            booking.soft_delete()
+        self.deleted_at = now
+        # Set-based UPDATEs rather than loading every related row
+        db.session.execute(
+            db.update(MaintenanceRecord)
+            .where(MaintenanceRecord.vehicle_id == self.id, MaintenanceRecord.is_deleted == False)
+            .values(is_deleted=True, deleted_at=now)
+        )
+        Booking.soft_delete_where(Booking.vehicle_id == self.id)
 
     def __repr__(self):
         return f"<Vehicle {self.registration_number}>"
@@ -129,6 +194,23 @@ class Vehicle(db.Model):
 # ---------------------------------------------------------------------------
 class Booking(db.Model):
     __tablename__ = "bookings"
+    __table_args__ = (
+        # Conflict detection: seeks the vehicle's pending/approved bookings
+        # that end after the proposed start, skipping its finished history;
+        # the trailing columns answer the rest of the check from the index
+        db.Index(
+            "ix_booking_conflict",
+            "vehicle_id", "status", "end_datetime_planned",
+            "start_datetime_planned", "is_deleted",
+        ),
+        # Status filters on the booking list; the end time lets the dashboard
+        # seek straight to approved bookings that haven't finished yet
+        db.Index("ix_booking_status_end", "status", "end_datetime_planned"),
+        # Keyset pages of the booking list, newest first, with or without
+        # a status filter (the rowid tie-breaker is implicit in both)
+        db.Index("ix_booking_start", "start_datetime_planned"),
+        db.Index("ix_booking_status_start", "status", "start_datetime_planned"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
 
@@ -180,6 +262,21 @@ class Booking(db.Model):
         if self.trip:
             self.trip.soft_delete()
 
+    @staticmethod
+    def soft_delete_where(*criteria):
+        """Mark every live booking matching *criteria*, and its trip, as deleted
+        with two UPDATE statements."""
+        now = datetime.now(timezone.utc)
+        live = (Booking.is_deleted == False, *criteria)
+        db.session.execute(
+            db.update(Trip)
+            .where(Trip.booking_id.in_(db.select(Booking.id).where(*live)))
+            .values(is_deleted=True, deleted_at=now)
+        )
+        db.session.execute(
+            db.update(Booking).where(*live).values(is_deleted=True, deleted_at=now)
+        )
+
     def __repr__(self):
         return f"<Booking {self.id} – {self.requester_name}>"
 
@@ -189,6 +286,15 @@ class Booking(db.Model):
 # ---------------------------------------------------------------------------
 class Trip(db.Model):
     __tablename__ = "trips"
+    __table_args__ = (
+        # Reports: completed trips only, filtered/ordered by actual start
+        db.Index(
+            "ix_trip_completed_start",
+            "start_actual_datetime", "booking_id",
+            sqlite_where=db.text("end_actual_datetime IS NOT NULL"),
+            postgresql_where=db.text("end_actual_datetime IS NOT NULL"),
+        ),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     booking_id = db.Column(
@@ -227,6 +333,10 @@ class Trip(db.Model):
 # ---------------------------------------------------------------------------
 class MaintenanceRecord(db.Model):
     __tablename__ = "maintenance_records"
+    __table_args__ = (
+        # A vehicle's records, and its open (scheduled) ones in particular
+        db.Index("ix_maintenance_vehicle_status", "vehicle_id", "status"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     vehicle_id = db.Column(
@@ -269,6 +379,12 @@ class MaintenanceRecord(db.Model):
 # ---------------------------------------------------------------------------
 class AuditLog(db.Model):
     __tablename__ = "audit_logs"
+    __table_args__ = (
+        # Keyset pages of the audit trail, with or without an entity filter;
+        # an action filter is checked while walking either
+        db.Index("ix_audit_timestamp", "timestamp"),
+        db.Index("ix_audit_entity_timestamp", "entity_type", "timestamp"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
@@ -357,13 +473,33 @@ class VehicleLocation(db.Model):
 # ---------------------------------------------------------------------------
 # Helper: Conflict Detection
 # ---------------------------------------------------------------------------
-def check_booking_conflict(vehicle_id, start_dt, end_dt, exclude_booking_id=None):
+def booking_conflict_criteria(vehicle_id, start_dt, end_dt, exclude_booking_id=None):
     """
-    Return a conflicting Booking if *vehicle_id* already has an approved (or
-    pending) booking whose planned window overlaps [start_dt, end_dt].
+    Return the WHERE clauses that match bookings of *vehicle_id* which are
+    still active (pending or approved) and overlap [start_dt, end_dt].
 
     Two intervals [A_start, A_end] and [B_start, B_end] overlap when:
         A_start < B_end  AND  B_start < A_end
+    """
+    criteria = [
+        Booking.vehicle_id == vehicle_id,
+        # Only consider bookings that are still "active" (pending or approved)
+        Booking.status.in_(["pending", "approved"]),
+        # Exclude soft-deleted bookings
+        Booking.is_deleted == False,
+        # Overlap condition
+        Booking.start_datetime_planned < end_dt,
+        Booking.end_datetime_planned > start_dt,
+    ]
+    if exclude_booking_id is not None:
+        criteria.append(Booking.id != exclude_booking_id)
+    return criteria
+
+
+def check_booking_conflict(vehicle_id, start_dt, end_dt, exclude_booking_id=None):
+    """
+    Return a conflicting Booking if *vehicle_id* already has an approved (or
+    pending) booking whose planned window overlaps [start_dt, end_dt].
 
     Parameters
     ----------
@@ -378,21 +514,38 @@ def check_booking_conflict(vehicle_id, start_dt, end_dt, exclude_booking_id=None
 
     Returns
     -------
-    Booking | None
-        The first conflicting booking found, or None if there is no conflict.
+    Row | None
+        The first conflicting booking's ``id``, ``requester_name``,
+        ``start_datetime_planned`` and ``end_datetime_planned`` (all that the
+        conflict messages show), or None if there is no conflict.
     """
-    query = Booking.query.filter(
-        Booking.vehicle_id == vehicle_id,
-        # Only consider bookings that are still "active" (pending or approved)
-        Booking.status.in_(["pending", "approved"]),
-        # Exclude soft-deleted bookings
-        Booking.is_deleted == False,
-        # Overlap condition
-        Booking.start_datetime_planned < end_dt,
-        Booking.end_datetime_planned > start_dt,
-    )
-
-    if exclude_booking_id is not None:
-        query = query.filter(Booking.id != exclude_booking_id)
+    return db.session.execute(
+        db.select(
+            Booking.id,
+            Booking.requester_name,
+            Booking.start_datetime_planned,
+            Booking.end_datetime_planned,
+        )
+        .where(*booking_conflict_criteria(vehicle_id, start_dt, end_dt, exclude_booking_id))
+        .limit(1)
+    ).first()
+
+
+def lock_vehicle_bookings(vehicle_id):
+    """
+    Serialise booking writes for *vehicle_id* until the current transaction
+    ends, so a conflict check and the write that follows it cannot interleave
+    with another request doing the same.
 
-    return query.first()
+    SQLite has no row locks, so its database write lock is taken up front with
+    BEGIN IMMEDIATE; other backends lock the vehicle row with SELECT … FOR
+    UPDATE. Reload anything read before the call, as it may be stale.
+    """
+    conn = db.session.connection()
+    if conn.dialect.name == "sqlite":
+        if not conn.connection.dbapi_connection.in_transaction:
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+    else:
+        db.session.execute(
+            db.select(Vehicle.id).where(Vehicle.id == vehicle_id).with_for_update()
+        )
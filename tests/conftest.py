@@ -4,8 +4,11 @@ Uses an in-memory SQLite database so tests never touch production data.
 """
 
 import pytest
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 
+from sqlalchemy import event
+
 from app import app as flask_app, limiter
 from models import db as _db, User, Vehicle, Booking, Trip, MaintenanceRecord
 
@@ -147,3 +150,38 @@ def login(client, username="testadmin", password="password123"):
         data={"username": username, "password": password},
         follow_redirects=True,
     )
+
+
+# ── Helper: Query counting ───────────────────────────────────────────────────
+
+
+@contextmanager
+def count_queries():
+    """Collect the SQL statements executed inside the ``with`` block."""
+    statements = []
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = _db.engine
+    event.listen(engine, "before_cursor_execute", _record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", _record)
+
+
+@contextmanager
+def count_commits():
+    """Collect one entry per database COMMIT inside the ``with`` block."""
+    commits = []
+
+    def _record(conn):
+        commits.append(conn)
+
+    engine = _db.engine
+    event.listen(engine, "commit", _record)
+    try:
+        yield commits
+    finally:
+        event.remove(engine, "commit", _record)
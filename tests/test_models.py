@@ -21,6 +21,12 @@ class TestUserModel:
             assert user.check_password("secret123") is True
             assert user.check_password("wrong") is False
 
+    def test_password_uses_scrypt(self, app):
+        with app.app_context():
+            user = User(username="kdftest", email="kdf@test.org", full_name="KDF Test")
+            user.set_password("secret123")
+            assert user.password_hash.startswith("scrypt:")
+
     def test_is_admin_property(self, app):
         with app.app_context():
             admin = User(username="a", email="a@a.com", full_name="A", role="admin")
@@ -89,6 +95,15 @@ class TestVehicleModel:
                 db.session.commit()
             db.session.rollback()
 
+    def test_unknown_status_rejected(self, app):
+        """The status column only accepts the values the app writes."""
+        with app.app_context():
+            v = Vehicle(registration_number="CHK 001", make="Toyota", model="Hilux", status="retired")
+            db.session.add(v)
+            with pytest.raises(Exception):
+                db.session.commit()
+            db.session.rollback()
+
 
 # ╔═══════════════════════════════════════════════════════════════════════════╗
 # ║  3. BOOKING MODEL                                                       ║
@@ -182,6 +197,24 @@ class TestBookingConflict:
             )
             assert result is not None
 
+    def test_conflict_carries_message_fields(self, app, vehicle, admin_user):
+        """The result holds what the conflict messages show."""
+        with app.app_context():
+            existing = self._create_booking(
+                vehicle.id, admin_user.id,
+                datetime(2026, 10, 14, 8, 0),
+                datetime(2026, 10, 14, 18, 0),
+            )
+            result = check_booking_conflict(
+                vehicle.id,
+                datetime(2026, 10, 14, 12, 0),
+                datetime(2026, 10, 14, 20, 0),
+            )
+            assert result.id == existing.id
+            assert result.requester_name == "Fixture"
+            assert result.start_datetime_planned == datetime(2026, 10, 14, 8, 0)
+            assert result.end_datetime_planned == datetime(2026, 10, 14, 18, 0)
+
     def test_partial_overlap_start(self, app, vehicle, admin_user):
         """New booking starts before existing ends."""
         with app.app_context():
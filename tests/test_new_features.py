@@ -1,10 +1,11 @@
 """
-Tests for new features: Change Password, Password Reset, User Profile, Admin Reset.
+Tests for new features: Change Password, Password Reset, User Profile, Admin Reset,
+Email Notifications, Database Init Command.
 """
 
 import pytest
 from models import db, User
-from tests.conftest import login
+from tests.conftest import count_queries, login
 
 
 # ╔═══════════════════════════════════════════════════════════════════════════╗
@@ -164,6 +165,24 @@ class TestPasswordReset:
         r = client.post("/forgot-password", data={"email": "admin@test.org"}, follow_redirects=True)
         assert b"if that email is registered" in r.data.lower()
 
+    def test_forgot_password_mails_reset_link(self, client, app, monkeypatch):
+        import app as app_module
+
+        u = User(username="resetmail", email="resetmail@test.org", full_name="Reset Mail", role="requester")
+        u.set_password("password123")
+        db.session.add(u)
+        db.session.commit()
+        sent = []
+        monkeypatch.setattr(app_module, "send_notification", lambda **kw: sent.append(kw))
+        client.post("/forgot-password", data={"email": "resetmail@test.org"})
+        db.session.expire_all()
+        token = User.query.filter_by(username="resetmail").one().password_reset_token
+        (mail,) = sent
+        assert mail["recipients"] == ["resetmail@test.org"]
+        assert mail["body"].startswith("Hello Reset Mail,")
+        assert "(resetmail)" in mail["body"]
+        assert f"/reset-password/{token}" in mail["body"]
+
     def test_forgot_password_unknown_email(self, client):
         r = client.post("/forgot-password", data={"email": "nobody@test.org"}, follow_redirects=True)
         assert b"if that email is registered" in r.data.lower()
@@ -284,6 +303,36 @@ class TestProfile:
         }, follow_redirects=True)
         assert b"already used" in r.data.lower()
 
+    def test_admin_user_edit_duplicate_email_names_owner(self, client, admin_user, driver_user):
+        login(client)
+        admin_id = User.query.filter_by(username="testadmin").first().id
+        r = client.post(f"/users/{admin_id}/edit", data={
+            "full_name": "Test Admin", "email": "driver@test.org",
+            "role": "admin", "is_active_user": "on",
+        }, follow_redirects=True)
+        assert b"already used by testdriver" in r.data.lower()
+
+    def test_admin_user_edit_keeps_legacy_email(self, client, admin_user):
+        legacy = User(username="legacymail", email="legacy mail@test.org",
+                      full_name="Legacy", role="requester")
+        legacy.set_password("password123")
+        db.session.add(legacy)
+        db.session.commit()
+        legacy_id = legacy.id
+
+        login(client)
+        form = {"full_name": "Legacy Renamed", "role": "requester", "is_active_user": "on"}
+        r = client.post(f"/users/{legacy_id}/edit", data={**form, "email": "legacy mail@test.org"},
+                        follow_redirects=True)
+        assert b"valid email" not in r.data.lower()
+        db.session.expire_all()
+        assert db.session.get(User, legacy_id).full_name == "Legacy Renamed"
+
+        # A new address still has to pass the check
+        r = client.post(f"/users/{legacy_id}/edit", data={**form, "email": "other mail@test.org"},
+                        follow_redirects=True)
+        assert b"valid email" in r.data.lower()
+
 
 # ╔═══════════════════════════════════════════════════════════════════════════╗
 # ║  ADMIN PASSWORD RESET                                                   ║
@@ -319,3 +368,258 @@ class TestAdminResetPassword:
             driver.set_password("password123")
             driver.must_change_password = False
             db.session.commit()
+
+
+# ╔═══════════════════════════════════════════════════════════════════════════╗
+# ║  EMAIL NOTIFICATIONS                                                    ║
+# ╚═══════════════════════════════════════════════════════════════════════════╝
+
+
+class TestNotifications:
+    def test_disabled_mail_is_skipped(self, app):
+        from app import send_notification
+        with app.test_request_context():
+            assert send_notification("Subject", ["a@test.org"], "Body") is None
+
+    @staticmethod
+    def _fake_smtp(monkeypatch, app_module):
+        """Replace mail.connect(); returns a list of (connection no., msg, thread)."""
+        import threading
+        from contextlib import contextmanager
+
+        sent, opened = [], []
+
+        @contextmanager
+        def connect():
+            opened.append(None)
+            conn_no = len(opened)
+
+            class Conn:
+                def send(self, msg):
+                    sent.append((conn_no, msg, threading.current_thread().name))
+
+            yield Conn()
+
+        monkeypatch.setattr(app_module.mail, "connect", connect)
+        return sent
+
+    def test_mail_is_sent_from_worker_thread(self, app, monkeypatch):
+        import app as app_module
+
+        sent = self._fake_smtp(monkeypatch, app_module)
+        monkeypatch.setitem(app.config, "MAIL_ENABLED", True)
+        with app.test_request_context():
+            future = app_module.send_notification(
+                "Subject", [], "Body", bcc=["a@test.org", "b@test.org"]
+            )
+        future.result(timeout=5)
+        _, msg, thread_name = sent[0]
+        assert thread_name.startswith("mail")
+        assert msg.bcc == ["a@test.org", "b@test.org"]
+
+    def test_batched_notifications_share_one_connection(self, app, monkeypatch):
+        import app as app_module
+
+        sent = self._fake_smtp(monkeypatch, app_module)
+        monkeypatch.setitem(app.config, "MAIL_ENABLED", True)
+        with app.test_request_context():
+            future = app_module.send_notifications([
+                dict(subject="One", recipients=["a@test.org"], body="1"),
+                dict(subject="Two", recipients=["b@test.org"], body="2"),
+            ])
+        future.result(timeout=5)
+        assert [(conn_no, msg.subject) for conn_no, msg, _ in sent] == [(1, "One"), (1, "Two")]
+
+    def test_admin_emails_cached_until_a_user_change_commits(self, app, admin_user):
+        from app import get_admin_emails, invalidate_admin_emails
+        invalidate_admin_emails()
+        get_admin_emails()
+        with count_queries() as statements:
+            get_admin_emails()
+        assert statements == []
+        u = User(username="cacheadmin", email="cacheadmin@test.org", full_name="Cache Admin", role="admin")
+        u.set_password("password123")
+        db.session.add(u)
+        assert "cacheadmin@test.org" not in get_admin_emails()  # not committed yet
+        db.session.commit()
+        assert "cacheadmin@test.org" in get_admin_emails()
+
+    def test_user_edit_invalidates_admin_emails(self, client, app, admin_user, driver_user):
+        from app import get_admin_emails
+        driver_id = User.query.filter_by(username="testdriver").first().id
+        login(client)
+        assert "driver@test.org" not in get_admin_emails()
+        client.post(f"/users/{driver_id}/edit", data={
+            "full_name": "Test Driver", "email": "driver@test.org",
+            "role": "admin", "is_active_user": "on",
+        }, follow_redirects=True)
+        assert "driver@test.org" in get_admin_emails()
+        client.post(f"/users/{driver_id}/edit", data={
+            "full_name": "Test Driver", "email": "driver@test.org",
+            "role": "driver", "is_active_user": "on",
+        }, follow_redirects=True)
+        assert "driver@test.org" not in get_admin_emails()
+
+    def _post_booking(self, client, day):
+        from models import Vehicle
+
+        vid = Vehicle.query.filter_by(registration_number="KAA 001A").first().id
+        return client.post("/bookings/add", data={
+            "vehicle_id": vid,
+            "start_datetime_planned": f"2035-03-{day:02d}T08:00",
+            "end_datetime_planned": f"2035-03-{day:02d}T17:00",
+            "route_from": "Nairobi", "route_to": "Nakuru", "purpose": "Field visit",
+        })
+
+    def test_booking_add_skips_admin_lookup_when_mail_disabled(self, client, app, admin_user, vehicle):
+        from app import invalidate_admin_emails
+
+        login(client)
+        invalidate_admin_emails()
+        with count_queries() as statements:
+            r = self._post_booking(client, 1)
+        assert r.status_code == 302
+        assert not any("users.role =" in s for s in statements)
+
+    def test_booking_add_notifies_admins_and_requester(self, client, app, admin_user, vehicle, monkeypatch):
+        import app as app_module
+
+        sent = self._fake_smtp(monkeypatch, app_module)
+        submitted = []
+        real_send = app_module.send_notifications
+        monkeypatch.setattr(app_module, "send_notifications",
+                            lambda outbox: submitted.append(real_send(outbox)))
+        monkeypatch.setitem(app.config, "MAIL_ENABLED", True)
+        login(client)
+        assert self._post_booking(client, 2).status_code == 302
+        submitted[0].result(timeout=5)
+        admin_msg, requester_msg = (msg for _, msg, _ in sent)
+        assert admin_msg.bcc == app_module.get_admin_emails()
+        assert "Nairobi → Nakuru" in admin_msg.body
+        assert requester_msg.subject.startswith("Booking Request #")
+
+    def test_booking_email_templates_render(self):
+        from datetime import datetime
+        from types import SimpleNamespace
+        from app import EMAIL_TEMPLATES, booking_email_context
+        b = SimpleNamespace(
+            id=987654, requester_name="Mail Tester",
+            vehicle=SimpleNamespace(registration_number="KAA 001A"),
+            start_datetime_planned=datetime(2030, 5, 6, 9, 15),
+            end_datetime_planned=datetime(2030, 5, 6, 17, 0),
+            route_from="Nairobi", route_to="Nakuru", purpose="Audit",
+        )
+        ctx = {**booking_email_context(b), "name": "Someone", "cancelled_by": ""}
+        for key, template in EMAIL_TEMPLATES.items():
+            body = template.format_map(ctx)
+            assert "From: 06 May 2030 09:15" in body, key
+            assert "Nairobi → Nakuru" in body, key
+
+    def test_format_datetime_matches_strftime(self):
+        from datetime import datetime
+        from app import format_datetime
+        for month in range(1, 13):
+            d = datetime(2031, month, 3, 7, 5)
+            assert format_datetime(d) == d.strftime("%d %b %Y %H:%M")
+
+
+# ╔═══════════════════════════════════════════════════════════════════════════╗
+# ║  DATABASE INIT COMMAND                                                  ║
+# ╚═══════════════════════════════════════════════════════════════════════════╝
+
+
+class TestInitDbCommand:
+    def test_init_db_creates_default_admin_once(self, app):
+        runner = app.test_cli_runner()
+        for _ in range(2):
+            result = runner.invoke(args=["init-db"])
+            assert result.exit_code == 0
+            assert "Database initialised" in result.output
+        db.session.expire_all()
+        admins = User.query.filter_by(username="admin").all()
+        assert len(admins) == 1
+        assert admins[0].must_change_password
+
+    def test_init_db_drops_superseded_booking_indexes(self, app):
+        db.session.execute(db.text(
+            "CREATE INDEX ix_booking_vehicle_status_end "
+            "ON bookings (vehicle_id, status, end_datetime_planned)"
+        ))
+        db.session.commit()
+        assert app.test_cli_runner().invoke(args=["init-db"]).exit_code == 0
+        names = db.session.execute(db.text(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'bookings'"
+        )).scalars().all()
+        assert "ix_booking_vehicle_status_end" not in names
+        assert "ix_booking_conflict" in names
+
+    def test_init_db_warns_about_dangling_foreign_keys(self, app, caplog):
+        db.session.execute(db.text("PRAGMA foreign_keys=OFF"))
+        db.session.execute(db.text(
+            "INSERT INTO audit_logs (id, user_id, username, action, entity_type, timestamp) "
+            "VALUES (990001, 990001, 'ghost', 'edit', 'User', '2030-01-01 00:00:00')"
+        ))
+        db.session.commit()
+        db.session.execute(db.text("PRAGMA foreign_keys=ON"))
+        try:
+            assert app.test_cli_runner().invoke(args=["init-db"]).exit_code == 0
+            assert "audit_logs rowid 990001 -> users" in caplog.text
+        finally:
+            db.session.execute(db.text("DELETE FROM audit_logs WHERE id = 990001"))
+            db.session.commit()
+
+    @staticmethod
+    def _pre_constraint_engine(tmp_path, statuses):
+        """A file database whose vehicles table predates ck_vehicle_status."""
+        from sqlalchemy import create_engine
+
+        engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+        with engine.begin() as conn:
+            conn.exec_driver_sql(
+                "CREATE TABLE vehicles (id INTEGER PRIMARY KEY, "
+                "registration_number VARCHAR(20) NOT NULL UNIQUE, make VARCHAR(50) NOT NULL, "
+                "model VARCHAR(50) NOT NULL, status VARCHAR(20) NOT NULL, "
+                "is_deleted BOOLEAN NOT NULL DEFAULT 0, deleted_at DATETIME, updated_at DATETIME)"
+            )
+            conn.exec_driver_sql(
+                "CREATE TABLE bookings (id INTEGER PRIMARY KEY, "
+                "vehicle_id INTEGER NOT NULL REFERENCES vehicles (id))"
+            )
+            for n, status in enumerate(statuses, 1):
+                conn.exec_driver_sql(
+                    f"INSERT INTO vehicles (id, registration_number, make, model, status) "
+                    f"VALUES ({n}, 'OLD {n}', 'Toyota', 'Hilux', '{status}')"
+                )
+                conn.exec_driver_sql(f"INSERT INTO bookings (id, vehicle_id) VALUES ({n}, {n})")
+        return engine
+
+    def test_status_check_added_to_existing_vehicles_table(self, app, tmp_path):
+        from sqlalchemy import inspect
+        from sqlalchemy.exc import IntegrityError
+        from app import add_vehicle_status_check
+
+        engine = self._pre_constraint_engine(tmp_path, ["available", "maintenance"])
+        assert add_vehicle_status_check(engine) is True
+        assert add_vehicle_status_check(engine) is True  # already migrated
+
+        names = [c["name"] for c in inspect(engine).get_check_constraints("vehicles")]
+        assert names == ["ck_vehicle_status"]
+        with engine.connect() as conn:
+            rows = conn.exec_driver_sql(
+                "SELECT b.id, v.status FROM bookings b JOIN vehicles v ON v.id = b.vehicle_id"
+            ).all()
+            assert rows == [(1, "available"), (2, "maintenance")]
+            assert conn.exec_driver_sql("PRAGMA foreign_key_check").all() == []
+            with pytest.raises(IntegrityError):
+                conn.exec_driver_sql("UPDATE vehicles SET status = 'retired' WHERE id = 1")
+        engine.dispose()
+
+    def test_status_check_skipped_when_rows_need_fixing(self, app, tmp_path, caplog):
+        from sqlalchemy import inspect
+        from app import add_vehicle_status_check
+
+        engine = self._pre_constraint_engine(tmp_path, ["available", "retired"])
+        assert add_vehicle_status_check(engine) is False
+        assert "#2 ('retired')" in caplog.text
+        assert inspect(engine).get_check_constraints("vehicles") == []
+        engine.dispose()
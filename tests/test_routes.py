@@ -5,8 +5,8 @@ Tests authentication, authorization, CRUD operations, and business rules.
 
 import pytest
 from datetime import datetime, timedelta
-from models import db, User, Vehicle, Booking, Trip, MaintenanceRecord
-from tests.conftest import login
+from models import db, AuditLog, User, Vehicle, Booking, Trip, MaintenanceRecord
+from tests.conftest import count_commits, count_queries, login
 
 
 # ╔═══════════════════════════════════════════════════════════════════════════╗
@@ -31,6 +31,22 @@ class TestAuthentication:
         r = login(client)
         assert b"welcome back" in r.data.lower()
 
+    def test_login_follows_local_next(self, client, admin_user):
+        r = client.post("/login?next=/vehicles?page=2",
+                        data={"username": "testadmin", "password": "password123"})
+        assert r.status_code == 302
+        assert r.headers["Location"] == "/vehicles?page=2"
+
+    @pytest.mark.parametrize("target", [
+        "https://evil.example/", "//evil.example/", "/\\evil.example/",
+        "/\t/evil.example/", "javascript:alert(1)",
+    ])
+    def test_login_rejects_offsite_next(self, client, admin_user, target):
+        r = client.post("/login", query_string={"next": target},
+                        data={"username": "testadmin", "password": "password123"})
+        assert r.status_code == 302
+        assert r.headers["Location"] == "/"
+
     def test_login_inactive_user(self, client, app, admin_user):
         """Deactivated users should be rejected at login."""
         with app.app_context():
@@ -41,11 +57,65 @@ class TestAuthentication:
         r = client.post("/login", data={"username": "inactive1", "password": "password123"}, follow_redirects=True)
         assert b"deactivated" in r.data.lower()
 
+    def test_login_unknown_user_still_hashes(self, client, monkeypatch):
+        calls = []
+        monkeypatch.setattr(User, "check_password_for_unknown_user",
+                            staticmethod(lambda pw: calls.append(pw) or False))
+        r = client.post("/login", data={"username": "nosuchuser", "password": "guess123"},
+                        follow_redirects=True)
+        assert b"invalid username or password" in r.data.lower()
+        assert calls == ["guess123"]
+
+    def test_login_upgrades_outdated_hash(self, client, app):
+        from werkzeug.security import generate_password_hash
+
+        with app.app_context():
+            user = User(username="oldhash1", email="oldhash@t.org", full_name="Old Hash", role="requester")
+            user.password_hash = generate_password_hash("password123", method="pbkdf2:sha256")
+            db.session.add(user)
+            db.session.commit()
+            assert user.password_needs_rehash()
+        r = client.post("/login", data={"username": "oldhash1", "password": "password123"}, follow_redirects=True)
+        assert b"welcome back" in r.data.lower()
+        with app.app_context():
+            user = User.query.filter_by(username="oldhash1").one()
+            assert user.password_hash.startswith("scrypt:")
+            assert not user.password_needs_rehash()
+            assert user.check_password("password123")
+
     def test_logout(self, client, admin_user):
         login(client)
         r = client.get("/logout", follow_redirects=True)
         assert b"logged out" in r.data.lower()
 
+    def test_recent_activity_leaves_session_cookie_alone(self, client, admin_user):
+        login(client)
+        client.get("/")
+        r = client.get("/vehicles")
+        assert r.status_code == 200
+        assert "Set-Cookie" not in r.headers
+
+    def test_stale_activity_time_is_rewritten(self, client, admin_user):
+        from datetime import timezone
+
+        login(client)
+        stale = datetime.now(timezone.utc) - timedelta(minutes=5)
+        with client.session_transaction() as sess:
+            sess["last_active"] = stale
+        r = client.get("/vehicles")
+        assert "Set-Cookie" in r.headers
+        with client.session_transaction() as sess:
+            assert sess["last_active"] > stale
+
+    def test_idle_session_expires(self, client, admin_user):
+        from datetime import timezone
+
+        login(client)
+        with client.session_transaction() as sess:
+            sess["last_active"] = datetime.now(timezone.utc) - timedelta(minutes=31)
+        r = client.get("/vehicles", follow_redirects=True)
+        assert b"expired due to inactivity" in r.data.lower()
+
     def test_unauthenticated_redirect(self, client):
         """Accessing a protected route without login should redirect."""
         r = client.get("/", follow_redirects=True)
@@ -77,6 +147,28 @@ class TestRegistration:
         }, follow_redirects=True)
         assert b"letters, numbers, dots" in r.data.lower()
 
+    def test_register_rejects_non_ascii_username(self, client):
+        r = client.post("/register", data={
+            "full_name": "X", "username": "josé", "email": "jose@x.com",
+            "password": "test1234", "password2": "test1234"
+        }, follow_redirects=True)
+        assert b"letters, numbers, dots" in r.data.lower()
+
+    def test_register_rejects_punctuation_only_username(self, client):
+        r = client.post("/register", data={
+            "full_name": "X", "username": "___", "email": "under@x.com",
+            "password": "test1234", "password2": "test1234"
+        }, follow_redirects=True)
+        assert b"letters, numbers, dots" in r.data.lower()
+        assert User.query.filter_by(username="___").first() is None
+
+    def test_register_invalid_email(self, client):
+        r = client.post("/register", data={
+            "full_name": "X", "username": "bademail", "email": "bad@@x .com",
+            "password": "test1234", "password2": "test1234"
+        }, follow_redirects=True)
+        assert b"valid email address" in r.data.lower()
+
     def test_register_short_password(self, client):
         r = client.post("/register", data={
             "full_name": "X", "username": "shortpw", "email": "sp@x.com",
@@ -98,6 +190,14 @@ class TestRegistration:
         }, follow_redirects=True)
         assert b"already taken" in r.data.lower()
 
+    def test_register_duplicate_email(self, client, driver_user):
+        r = client.post("/register", data={
+            "full_name": "X", "username": "freshname", "email": "driver@test.org",
+            "password": "test1234", "password2": "test1234"
+        }, follow_redirects=True)
+        assert b"already registered" in r.data.lower()
+        assert b"already taken" not in r.data.lower()
+
     def test_register_success(self, client):
         r = client.post("/register", data={
             "full_name": "New User", "username": "newuser99",
@@ -163,6 +263,49 @@ class TestVehicleCRUD:
         }, follow_redirects=True)
         assert b"already exists" in r.data.lower()
 
+    def test_add_vehicle_reusing_archived_reg(self, client, admin_user):
+        db.session.add(Vehicle(registration_number="ARC 001", make="Toyota", model="Hilux",
+                               is_deleted=True))
+        db.session.commit()
+        login(client)
+        r = client.post("/vehicles/add", data={
+            "registration_number": "ARC 001", "make": "Ford", "model": "Ranger", "status": "available"
+        }, follow_redirects=True)
+        assert r.status_code == 200
+        assert b"belongs to an archived vehicle" in r.data.lower()
+
+    def test_edit_vehicle_duplicate_reg(self, client, admin_user, vehicle):
+        v = Vehicle(registration_number="DUP 002", make="Toyota", model="Hilux")
+        db.session.add(v)
+        db.session.commit()
+        vid = v.id
+        login(client)
+        r = client.post(f"/vehicles/{vid}/edit", data={
+            "registration_number": "KAA 001A", "make": "Toyota",
+            "model": "Hilux", "status": "available",
+        }, follow_redirects=True)
+        assert b"already exists" in r.data.lower()
+        db.session.expire_all()
+        assert db.session.get(Vehicle, vid).registration_number == "DUP 002"
+
+    def test_edit_vehicle_commits_change_and_audit_together(self, client, admin_user):
+        from models import AuditLog
+
+        v = Vehicle(registration_number="AUD 001", make="Toyota", model="Hilux")
+        db.session.add(v)
+        db.session.commit()
+        vid = v.id
+        login(client)
+        with count_commits() as commits:
+            r = client.post(f"/vehicles/{vid}/edit", data={
+                "registration_number": "AUD 001", "make": "Toyota",
+                "model": "Land Cruiser", "status": "available",
+            })
+        assert r.status_code == 302
+        assert len(commits) == 2  # the edit + its audit entry, then the page-view record
+        entry = AuditLog.query.filter_by(entity_type="Vehicle", entity_id=vid).one()
+        assert "Land Cruiser" in entry.details
+
     def test_vehicle_list_loads(self, client, admin_user, vehicle):
         login(client)
         r = client.get("/vehicles")
@@ -247,6 +390,47 @@ class TestBookingWorkflow:
         }, follow_redirects=True)
         assert b"already booked" in r.data.lower()
 
+    def test_add_booking_checks_conflicts_once_under_lock(self, client, admin_user, vehicle):
+        login(client)
+        with count_queries() as statements:
+            r = client.post("/bookings/add", data={
+                "vehicle_id": vehicle.id,
+                "start_datetime_planned": "2027-02-03T08:00",
+                "end_datetime_planned": "2027-02-03T18:00",
+                "route_from": "X", "route_to": "Y", "purpose": "Locked",
+            })
+        assert r.status_code == 302
+        locks = [i for i, sql in enumerate(statements) if sql == "BEGIN IMMEDIATE"]
+        conflict_checks = [
+            i for i, sql in enumerate(statements)
+            if sql.startswith("SELECT") and "bookings.end_datetime_planned >" in sql
+        ]
+        assert len(conflict_checks) == 1
+        assert locks and locks[0] < conflict_checks[0]
+
+    def test_add_booking_busy_vehicle_asks_to_retry(self, client, admin_user, vehicle, monkeypatch):
+        import app as app_module
+        from sqlalchemy.exc import OperationalError
+
+        def locked(vehicle_id):
+            raise OperationalError("BEGIN IMMEDIATE", {}, Exception("database is locked"))
+
+        monkeypatch.setattr(app_module, "lock_vehicle_bookings", locked)
+        login(client)
+        r = client.post("/bookings/add", data={
+            "vehicle_id": vehicle.id,
+            "start_datetime_planned": "2027-02-04T08:00",
+            "end_datetime_planned": "2027-02-04T18:00",
+            "route_from": "X", "route_to": "Busy", "purpose": "Locked out",
+        }, follow_redirects=True)
+        assert b"please try again" in r.data.lower()
+        assert Booking.query.filter_by(route_to="Busy").count() == 0
+
+    def test_sqlite_writers_wait_for_the_lock(self, app):
+        from app import SQLITE_BUSY_TIMEOUT_MS
+
+        assert db.session.execute(db.text("PRAGMA busy_timeout")).scalar() == SQLITE_BUSY_TIMEOUT_MS
+
     def test_approve_pending_booking(self, client, app, admin_user, vehicle):
         login(client)
         with app.app_context():
@@ -262,6 +446,29 @@ class TestBookingWorkflow:
         r = client.post(f"/bookings/{bid}/approve", follow_redirects=True)
         assert b"approved" in r.data.lower()
 
+    def test_approve_takes_write_lock_before_conflict_check(self, client, app, admin_user, vehicle):
+        login(client)
+        with app.app_context():
+            b = Booking(
+                requester_name="Test", requester_id=admin_user.id, vehicle_id=vehicle.id,
+                start_datetime_planned=datetime(2027, 3, 2, 8, 0),
+                end_datetime_planned=datetime(2027, 3, 2, 18, 0),
+                route_from="A", route_to="B", purpose="T", status="pending",
+            )
+            db.session.add(b)
+            db.session.commit()
+            bid = b.id
+        with count_queries() as statements:
+            client.post(f"/bookings/{bid}/approve")
+        locks = [i for i, sql in enumerate(statements) if sql == "BEGIN IMMEDIATE"]
+        conflict_checks = [
+            i for i, sql in enumerate(statements)
+            if sql.startswith("SELECT") and "bookings.end_datetime_planned >" in sql
+        ]
+        assert locks and conflict_checks and locks[0] < conflict_checks[0]
+        db.session.expire_all()
+        assert db.session.get(Booking, bid).status == "approved"
+
     def test_cancel_booking(self, client, app, admin_user, vehicle):
         login(client)
         with app.app_context():
@@ -341,6 +548,33 @@ class TestTripWorkflow:
         }, follow_redirects=True)
         assert b"trip started" in r.data.lower()
 
+    def test_trip_start_race_loses_gracefully(self, client, app, admin_user, vehicle, monkeypatch):
+        import app as app_module
+
+        login(client)
+        bid = self._create_approved_booking(app, admin_user, vehicle, 8)
+        real_get = app_module.get_booking_or_404
+        raced = []
+
+        def get_then_race(booking_id):
+            booking = real_get(booking_id)
+            if not raced:
+                # Another request starts the trip after this one has checked
+                raced.append(booking_id)
+                with db.engine.begin() as conn:
+                    conn.execute(Trip.__table__.insert().values(
+                        booking_id=booking_id, odometer_start=1, is_deleted=False,
+                    ))
+            return booking
+
+        monkeypatch.setattr(app_module, "get_booking_or_404", get_then_race)
+        r = client.post(f"/bookings/{bid}/trip/start", data={
+            "start_actual_datetime": "2027-06-09T08:30", "odometer_start": "50000",
+            "fuel_level_start": "45"
+        }, follow_redirects=True)
+        assert r.status_code == 200
+        assert b"already been started" in r.data.lower()
+
     def test_trip_end_odometer_less_than_start(self, client, app, admin_user, vehicle):
         login(client)
         bid = self._create_approved_booking(app, admin_user, vehicle, 3)
@@ -382,6 +616,20 @@ class TestTripWorkflow:
         }, follow_redirects=True)
         assert b"cannot be negative" in r.data.lower()
 
+    def test_trip_end_malformed_numbers(self, client, app, admin_user, vehicle):
+        login(client)
+        bid = self._create_approved_booking(app, admin_user, vehicle, 7)
+        client.post(f"/bookings/{bid}/trip/start", data={
+            "start_actual_datetime": "2027-06-08T08:30", "odometer_start": "50000",
+            "fuel_level_start": "45"
+        }, follow_redirects=True)
+        r = client.post(f"/bookings/{bid}/trip/end", data={
+            "end_actual_datetime": "2027-06-08T17:30", "odometer_end": "50.5k",
+            "fuel_level_end": "10", "fuel_cost_per_litre": "cheap"
+        }, follow_redirects=True)
+        assert b"must be a whole number" in r.data.lower()
+        assert b"cost per litre must be a number" in r.data.lower()
+
     def test_trip_end_success(self, client, app, admin_user, vehicle):
         login(client)
         bid = self._create_approved_booking(app, admin_user, vehicle, 6)
@@ -437,6 +685,14 @@ class TestMaintenance:
         }, follow_redirects=True)
         assert b"cannot be negative" in r.data.lower()
 
+    def test_add_maintenance_invalid_date(self, client, admin_user):
+        login(client)
+        r = client.post("/maintenance/add", data={
+            "vehicle_id": "", "maintenance_type": "routine",
+            "description": "Oil change", "scheduled_date": "2027-02-30",
+        }, follow_redirects=True)
+        assert b"invalid date format" in r.data.lower()
+
     def test_add_maintenance_success(self, client, admin_user, vehicle):
         login(client)
         r = client.post("/maintenance/add", data={
@@ -446,6 +702,70 @@ class TestMaintenance:
         }, follow_redirects=True)
         assert b"maintenance record created" in r.data.lower()
 
+    def _scheduled_record(self, reg):
+        v = Vehicle(registration_number=reg, make="Toyota", model="Hilux", status="maintenance")
+        db.session.add(v)
+        db.session.flush()
+        rec = MaintenanceRecord(
+            vehicle_id=v.id, maintenance_type="repair", description="Clutch",
+            scheduled_date=datetime(2027, 9, 1).date(),
+        )
+        db.session.add(rec)
+        db.session.commit()
+        return rec.id, v.id
+
+    def test_complete_maintenance(self, client, admin_user):
+        rec_id, vid = self._scheduled_record("MNT 201")
+        login(client)
+        r = client.post(f"/maintenance/{rec_id}/complete", data={"cost": "7500"},
+                        follow_redirects=True)
+        assert b"vehicle is now available" in r.data.lower()
+        db.session.expire_all()
+        rec = db.session.get(MaintenanceRecord, rec_id)
+        assert (rec.status, rec.cost) == ("completed", 7500)
+        assert rec.completed_date is not None
+        assert db.session.get(Vehicle, vid).status == "available"
+
+    def test_cancel_maintenance(self, client, admin_user):
+        rec_id, vid = self._scheduled_record("MNT 202")
+        login(client)
+        r = client.post(f"/maintenance/{rec_id}/cancel", follow_redirects=True)
+        assert b"maintenance record cancelled" in r.data.lower()
+        db.session.expire_all()
+        assert db.session.get(MaintenanceRecord, rec_id).status == "cancelled"
+        assert db.session.get(Vehicle, vid).status == "available"
+
+    def test_complete_maintenance_rejects_bad_cost(self, client, admin_user):
+        rec_id, vid = self._scheduled_record("MNT 203")
+        login(client)
+        r = client.post(f"/maintenance/{rec_id}/complete", data={"cost": "lots"},
+                        follow_redirects=True)
+        assert r.status_code == 200
+        assert b"cost must be a number" in r.data.lower()
+        db.session.expire_all()
+        assert db.session.get(MaintenanceRecord, rec_id).status == "scheduled"
+
+    def test_complete_missing_maintenance_404(self, client, admin_user):
+        login(client)
+        assert client.post("/maintenance/999999/complete").status_code == 404
+
+    def test_add_maintenance_sets_status_in_one_commit(self, client, app, admin_user):
+        v = Vehicle(registration_number="MNT 101", make="Toyota", model="Hilux")
+        db.session.add(v)
+        db.session.commit()
+        vid = v.id
+        login(client)
+        with count_commits() as commits:
+            r = client.post("/maintenance/add", data={
+                "vehicle_id": vid, "maintenance_type": "repair",
+                "description": "Brakes", "scheduled_date": "2027-08-02",
+                "set_maintenance": "on",
+            })
+        assert r.status_code == 302
+        assert len(commits) == 2  # the maintenance write + the page-view record
+        db.session.expire_all()
+        assert db.session.get(Vehicle, vid).status == "maintenance"
+
 
 # ╔═══════════════════════════════════════════════════════════════════════════╗
 # ║  7. REPORTS & CALENDAR                                                   ║
@@ -458,11 +778,80 @@ class TestReportsAndCalendar:
         r = client.get("/reports/vehicle")
         assert r.status_code == 200
 
+    def test_vehicle_report_rejects_malformed_dates(self, client, admin_user, vehicle):
+        login(client)
+        vid = Vehicle.query.filter_by(registration_number="KAA 001A").first().id
+        r = client.get(f"/reports/vehicle?vehicle_id={vid}&date_from=2030-13-01&date_to=x")
+        assert r.status_code == 200
+        assert b"valid dates" in r.data
+        r = client.get(f"/reports/vehicle/export?vehicle_id={vid}&date_from=nope&date_to=2030-01-31")
+        assert r.status_code == 302
+
     def test_budget_report_page_loads(self, client, admin_user):
         login(client)
         r = client.get("/reports/budget")
         assert r.status_code == 200
 
+    def test_budget_report_sorted_with_zero_totals(self, client, admin_user):
+        admin_id = _admin_id()
+        for i, code in enumerate(("PRJ-ZULU", "PRJ-ALFA")):
+            v = Vehicle(registration_number=f"BGT 00{i}", make="Toyota", model="Hilux")
+            db.session.add(v)
+            db.session.flush()
+            b = Booking(
+                requester_name="Budget", requester_id=admin_id, vehicle_id=v.id,
+                start_datetime_planned=datetime(2032, 5, 1, 8, 0),
+                end_datetime_planned=datetime(2032, 5, 1, 18, 0),
+                route_from="A", route_to="B", purpose="T", status="completed",
+                project_code=code,
+            )
+            db.session.add(b)
+            db.session.flush()
+            db.session.add(Trip(
+                booking_id=b.id,
+                start_actual_datetime=datetime(2032, 5, 1, 8, 0),
+                end_actual_datetime=datetime(2032, 5, 1, 9, 0),
+            ))
+        db.session.commit()
+        login(client)
+        r = client.get("/reports/budget")
+        assert r.status_code == 200
+        assert r.data.index(b"PRJ-ALFA") < r.data.index(b"PRJ-ZULU")
+
+    def test_analytics_counters(self, client, app, admin_user):
+        from flask import template_rendered
+        from models import PageView
+
+        login(client)
+        client.get("/vehicles")
+        expected = PageView.query.count()
+        rendered = []
+
+        def record(sender, template, context, **extra):
+            rendered.append(context)
+
+        template_rendered.connect(record, app)
+        try:
+            r = client.get("/analytics")
+        finally:
+            template_rendered.disconnect(record, app)
+        assert r.status_code == 200
+        ctx = rendered[0]
+        assert ctx["total_views"] == expected
+        assert 1 <= ctx["today_views"] <= ctx["week_views"] <= ctx["month_views"] <= expected
+
+    def test_page_view_hook_discards_abandoned_changes(self, app):
+        from app import _analytics_track_page_view
+        from models import PageView
+
+        views = PageView.query.count()
+        db.session.add(Vehicle(registration_number="ABANDON 1", make="Toyota", model="Hilux"))
+        with app.test_request_context("/vehicles/add", method="POST"):
+            _analytics_track_page_view(app.response_class(status=302))
+        db.session.expire_all()
+        assert Vehicle.query.filter_by(registration_number="ABANDON 1").first() is None
+        assert PageView.query.count() == views + 1
+
     def test_calendar_page_loads(self, client, admin_user):
         login(client)
         r = client.get("/calendar")
@@ -474,11 +863,150 @@ class TestReportsAndCalendar:
         assert r.status_code == 200
         assert r.content_type == "application/json"
 
+    def test_api_bookings_limited_to_requested_window(self, client, app, admin_user, vehicle):
+        login(client)
+        with app.app_context():
+            admin_id = User.query.filter_by(username="testadmin").first().id
+            vid = Vehicle.query.filter_by(registration_number="KAA 001A").first().id
+            for day, route in ((3, "InWindow"), (20, "OutOfWindow")):
+                db.session.add(Booking(
+                    requester_name="Test", requester_id=admin_id, vehicle_id=vid,
+                    start_datetime_planned=datetime(2032, 2, day, 8, 0),
+                    end_datetime_planned=datetime(2032, 2, day, 18, 0),
+                    route_from=route, route_to="B", purpose="T", status="approved",
+                ))
+            db.session.commit()
+        r = client.get(
+            "/api/bookings?start=2032-02-01T00:00:00%2B03:00&end=2032-02-08T00:00:00%2B03:00"
+        )
+        titles = [e["title"] for e in r.get_json()]
+        assert any("InWindow" in t for t in titles)
+        assert not any("OutOfWindow" in t for t in titles)
+
+    def test_api_bookings_cached_until_booking_change(self, client, app, admin_user, vehicle):
+        login(client)
+        url = "/api/bookings?start=2033-05-01T00:00:00&end=2033-05-08T00:00:00"
+        assert client.get(url).get_json() == []
+        with count_queries() as statements:
+            client.get(url)
+        assert not [s for s in statements if "FROM bookings" in s]
+
+        vid = Vehicle.query.filter_by(registration_number="KAA 001A").first().id
+        db.session.add(Booking(
+            requester_name="Test", requester_id=_admin_id(), vehicle_id=vid,
+            start_datetime_planned=datetime(2033, 5, 2, 8, 0),
+            end_datetime_planned=datetime(2033, 5, 2, 18, 0),
+            route_from="Cached", route_to="B", purpose="T", status="pending",
+        ))
+        db.session.commit()
+        events = client.get(url).get_json()
+        assert [e["title"] for e in events] == ["KAA 001A – Cached→B"]
+
+    def test_api_bookings_escapes_route_fields(self, client, app, admin_user, vehicle):
+        login(client)
+        vid = Vehicle.query.filter_by(registration_number="KAA 001A").first().id
+        db.session.add(Booking(
+            requester_name="Test", requester_id=_admin_id(), vehicle_id=vid,
+            start_datetime_planned=datetime(2033, 6, 2, 8, 0),
+            end_datetime_planned=datetime(2033, 6, 2, 18, 0),
+            route_from="<b>&lt;", route_to='"B"', purpose="T", status="pending",
+        ))
+        db.session.commit()
+        events = client.get("/api/bookings?start=2033-06-01&end=2033-06-08").get_json()
+        assert [e["title"] for e in events] == [
+            "KAA 001A – &lt;b&gt;&amp;lt;→&quot;B&quot;"
+        ]
+
     def test_audit_log_loads(self, client, admin_user):
         login(client)
         r = client.get("/audit-log")
         assert r.status_code == 200
 
+    def test_audit_log_keyset_pages_within_entity_filter(self, client, app, admin_user):
+        import re
+        from urllib.parse import unquote
+
+        from app import PER_PAGE
+
+        base = datetime(2031, 3, 1, 8, 0)
+        for n in range(PER_PAGE + 3):
+            db.session.add(AuditLog(
+                username="pager", action="edit", entity_type="KeysetTest",
+                entity_id=n, details=f"entry-{n}", timestamp=base + timedelta(minutes=n),
+            ))
+        db.session.commit()
+
+        def page(url):
+            html = client.get(url).get_data(as_text=True)
+            entries = [int(n) for n in re.findall(r"entry-(\d+)", html)]
+            cursors = {k: unquote(v) for k, v in re.findall(r'href="/audit-log\?(after|before)=([^&"]+)', html)}
+            return entries, cursors
+
+        login(client)
+        first, cursors = page("/audit-log?entity=KeysetTest")
+        second, back = page(f"/audit-log?entity=KeysetTest&before={cursors['before']}")
+        assert first + second == list(range(PER_PAGE + 2, -1, -1))
+        assert "before" not in back
+        assert page(f"/audit-log?entity=KeysetTest&after={back['after']}")[0] == first
+
+    def test_audit_log_pages_seek_timestamp_indexes(self, app):
+        for entity_clause, index in (("", "ix_audit_timestamp"),
+                                     ("entity_type = 'Booking' AND ", "ix_audit_entity_timestamp")):
+            plan = db.session.execute(db.text(
+                "EXPLAIN QUERY PLAN SELECT id FROM audit_logs WHERE " + entity_clause
+                + "(timestamp, id) < ('2030-01-05', 9) ORDER BY timestamp DESC, id DESC LIMIT 21"
+            )).all()
+            assert any(index in row[-1] for row in plan)
+            assert not any("TEMP B-TREE" in row[-1] for row in plan)
+
+    def test_vehicle_report_export_xlsx(self, client, app, admin_user, vehicle,
+                                        tmp_path, monkeypatch):
+        import tempfile
+        from io import BytesIO
+        from openpyxl import load_workbook
+
+        monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+        login(client)
+        with app.app_context():
+            admin_id = User.query.filter_by(username="testadmin").first().id
+            vid = Vehicle.query.filter_by(registration_number="KAA 001A").first().id
+            b = Booking(
+                requester_name="Exporter With A Rather Long Name", requester_id=admin_id, vehicle_id=vid,
+                start_datetime_planned=datetime(2031, 3, 4, 8, 0),
+                end_datetime_planned=datetime(2031, 3, 4, 18, 0),
+                route_from="Depot", route_to="Field", purpose="T", status="completed",
+            )
+            db.session.add(b)
+            db.session.flush()
+            db.session.add(Trip(
+                booking_id=b.id,
+                start_actual_datetime=datetime(2031, 3, 4, 8, 30),
+                end_actual_datetime=datetime(2031, 3, 4, 17, 0),
+                odometer_start=1000, odometer_end=1120, distance=120,
+                fuel_used=12.0, fuel_cost_per_litre=180.0, fuel_cost=2160.0,
+            ))
+            db.session.commit()
+
+        r = client.get(
+            f"/reports/vehicle/export?vehicle_id={vid}"
+            "&date_from=2031-03-01&date_to=2031-03-31"
+        )
+        assert r.status_code == 200
+        assert r.content_length == len(r.data)
+        assert list(tmp_path.iterdir()) == []  # no temp files left behind
+        ws = load_workbook(BytesIO(r.data))["Trip Report"]
+        rows = list(ws.iter_rows(values_only=True))
+        assert rows[0][0].startswith("Trip Report – KAA 001A")
+        assert rows[3][0] == "Trip #"
+        assert rows[4][2] == "Exporter With A Rather Long Name"
+        assert rows[4][4] == "Depot → Field"
+        assert rows[4][5:7] == ("04 Mar 2031 08:30", "04 Mar 2031 17:00")
+        assert rows[5][6:9] == ("TOTAL", 120, 12)
+        assert rows[5][10] == 2160
+        assert "A1:J1" in {str(rng) for rng in ws.merged_cells.ranges}
+        assert ws.column_dimensions["C"].width == 35  # longest requester + padding
+        assert ws.column_dimensions["D"].width == 22  # no driver: minimum width
+
 
 # ╔═══════════════════════════════════════════════════════════════════════════╗
 # ║  8. ADMIN DELETE OPERATIONS                                              ║
@@ -504,3 +1032,453 @@ class TestAdminDelete:
             v = db.session.get(Vehicle, vid)
             assert v is not None
             assert v.is_deleted is True
+
+    def test_delete_vehicle_archives_bookings_trips_and_maintenance(self, client, admin_user):
+        v = Vehicle(registration_number="DEL 002", make="Del", model="Test")
+        db.session.add(v)
+        db.session.flush()
+        b = Booking(
+            requester_name="Test", requester_id=_admin_id(), vehicle_id=v.id,
+            start_datetime_planned=datetime(2034, 1, 1, 8, 0),
+            end_datetime_planned=datetime(2034, 1, 1, 18, 0),
+            route_from="A", route_to="B", purpose="T", status="completed",
+        )
+        db.session.add(b)
+        db.session.flush()
+        t = Trip(booking_id=b.id, odometer_start=1)
+        m = MaintenanceRecord(
+            vehicle_id=v.id, maintenance_type="routine", description="Oil",
+            scheduled_date=datetime(2034, 1, 2).date(),
+        )
+        db.session.add_all([t, m])
+        db.session.commit()
+        ids = v.id, b.id, t.id, m.id
+
+        login(client)
+        client.post(f"/vehicles/{ids[0]}/delete")
+        db.session.expire_all()
+        for model, pk in zip((Vehicle, Booking, Trip, MaintenanceRecord), ids):
+            row = db.session.get(model, pk)
+            assert row.is_deleted is True and row.deleted_at is not None
+
+    def test_delete_user_archives_requests_and_unassigns_driver(self, client, admin_user):
+        u = User(username="leaver", email="leaver@test.org", full_name="Leaver", role="driver")
+        u.set_password("password123")
+        v = Vehicle(registration_number="DEL 003", make="Del", model="Test")
+        db.session.add_all([u, v])
+        db.session.flush()
+        window = dict(
+            vehicle_id=v.id, route_from="A", route_to="B", purpose="T", status="approved",
+            start_datetime_planned=datetime(2034, 2, 1, 8, 0),
+            end_datetime_planned=datetime(2034, 2, 1, 18, 0),
+        )
+        requested = Booking(requester_name="Leaver", requester_id=u.id, **window)
+        driven = Booking(requester_name="Admin", requester_id=_admin_id(), driver_id=u.id, **window)
+        db.session.add_all([requested, driven])
+        db.session.commit()
+        user_id, requested_id, driven_id = u.id, requested.id, driven.id
+
+        login(client)
+        feed = "/api/bookings?start=2034-02-01&end=2034-02-02"
+        assert len(client.get(feed).get_json()) == 2
+        client.post(f"/users/{user_id}/delete")
+        db.session.expire_all()
+        assert db.session.get(User, user_id).is_active_user is False
+        assert db.session.get(Booking, requested_id).is_deleted is True
+        driven = db.session.get(Booking, driven_id)
+        assert (driven.is_deleted, driven.driver_id) == (False, None)
+        # The bulk UPDATEs still invalidate the cached calendar feed
+        assert [e["id"] for e in client.get(feed).get_json()] == [driven_id]
+
+    def test_assign_driver_rejects_unknown_or_non_driver_ids(self, client, admin_user, driver_user):
+        driver_id = User.query.filter_by(username="testdriver").first().id
+        v = Vehicle(registration_number="DRV 001", make="Toyota", model="Hilux")
+        db.session.add(v)
+        db.session.flush()
+        b = Booking(
+            requester_name="Admin", requester_id=_admin_id(), driver_id=driver_id,
+            vehicle_id=v.id, route_from="A", route_to="B", purpose="T", status="approved",
+            start_datetime_planned=datetime(2034, 3, 1, 8, 0),
+            end_datetime_planned=datetime(2034, 3, 1, 18, 0),
+        )
+        db.session.add(b)
+        db.session.commit()
+        booking_id = b.id
+
+        login(client)
+        for bad in ("abc", "999999", str(_admin_id())):
+            r = client.post(f"/bookings/{booking_id}/assign-driver",
+                            data={"driver_id": bad}, follow_redirects=True)
+            assert r.status_code == 200
+            assert b"Please select an active driver." in r.data
+            db.session.expire_all()
+            assert db.session.get(Booking, booking_id).driver_id == driver_id
+
+        r = client.post(f"/bookings/{booking_id}/assign-driver",
+                        data={"driver_id": ""}, follow_redirects=True)
+        assert b"Driver removed from booking." in r.data
+        db.session.expire_all()
+        assert db.session.get(Booking, booking_id).driver_id is None
+
+
+# ╔═══════════════════════════════════════════════════════════════════════════╗
+# ║  9. QUERY EFFICIENCY                                                     ║
+# ╚═══════════════════════════════════════════════════════════════════════════╝
+
+
+def _admin_id():
+    return User.query.filter_by(username="testadmin").first().id
+
+
+def _vehicle_selects(statements):
+    return [s for s in statements if "FROM vehicles" in s]
+
+
+class TestQueryEfficiency:
+    def _make_bookings(self, requester_id, status, count=3, prefix="NPO"):
+        for i in range(count):
+            v = Vehicle(registration_number=f"{prefix} {status[:3].upper()}{i}", make="Toyota", model="Hilux")
+            db.session.add(v)
+            db.session.flush()
+            db.session.add(Booking(
+                requester_name="Test", requester_id=requester_id, vehicle_id=v.id,
+                start_datetime_planned=datetime(2030, 1, 1 + i, 8, 0),
+                end_datetime_planned=datetime(2030, 1, 1 + i, 18, 0),
+                route_from="A", route_to="B", purpose="T", status=status,
+            ))
+        db.session.commit()
+
+    def test_booking_list_loads_vehicles_in_one_query(self, client, app, admin_user):
+        self._make_bookings(_admin_id(), "pending")
+        login(client)
+        # Expire cached instances so relationship loads have to hit the DB
+        db.session.expire_all()
+        with count_queries() as statements:
+            r = client.get("/bookings")
+        assert r.status_code == 200
+        assert len(_vehicle_selects(statements)) == 1
+
+    def test_booking_list_keyset_pages(self, client, app, admin_user):
+        import re
+        from urllib.parse import unquote
+
+        from app import PER_PAGE
+
+        self._make_bookings(_admin_id(), "pending", count=PER_PAGE + 5, prefix="KSP")
+        expected = [b.id for b in Booking.query.filter_by(is_deleted=False).order_by(
+            Booking.start_datetime_planned.desc(), Booking.id.desc())]
+
+        def page(url):
+            html = client.get(url).get_data(as_text=True)
+            ids = [int(i) for i in re.findall(r'href="/bookings/(\d+)"', html)]
+            cursors = {k: unquote(v) for k, v in re.findall(r'href="/bookings\?(after|before)=([^&"]+)', html)}
+            return list(dict.fromkeys(ids)), cursors
+
+        login(client)
+        seen, url, first_pages = [], "/bookings", []
+        while url:
+            ids, cursors = page(url)
+            assert len(ids) <= PER_PAGE
+            first_pages.append((ids, cursors))
+            seen += ids
+            url = f"/bookings?before={cursors['before']}" if "before" in cursors else None
+        assert seen == expected
+
+        # Stepping back from page two lands on page one again
+        newer = first_pages[1][1]["after"]
+        assert page(f"/bookings?after={newer}")[0] == first_pages[0][0]
+
+    def test_booking_list_pages_seek_start_indexes(self, app):
+        for status_clause, index in (("", "ix_booking_start"),
+                                     ("AND status = 'pending' ", "ix_booking_status_start")):
+            plan = db.session.execute(db.text(
+                "EXPLAIN QUERY PLAN SELECT id FROM bookings WHERE is_deleted = 0 " + status_clause
+                + "AND (start_datetime_planned, id) < ('2030-01-05', 9) "
+                "ORDER BY start_datetime_planned DESC, id DESC LIMIT 21"
+            )).all()
+            assert any(index in row[-1] for row in plan)
+            assert not any("TEMP B-TREE" in row[-1] for row in plan)
+
+    def test_booking_list_ignores_garbled_cursor(self, client, admin_user):
+        login(client)
+        assert client.get("/bookings?before=not-a-cursor").status_code == 200
+
+    def test_dashboard_loads_vehicles_in_one_query(self, client, app, admin_user):
+        self._make_bookings(_admin_id(), "approved")
+        login(client)
+        db.session.expire_all()
+        with count_queries() as statements:
+            r = client.get("/")
+        assert r.status_code == 200
+        assert len(_vehicle_selects(statements)) <= 2  # vehicle count + eager load
+
+    def test_approve_loads_booking_relations_in_one_query(self, client, app, admin_user,
+                                                          driver_user, vehicle):
+        driver_id = User.query.filter_by(username="testdriver").first().id
+        vid = Vehicle.query.filter_by(registration_number="KAA 001A").first().id
+        b = Booking(
+            requester_name="Test", requester_id=_admin_id(), driver_id=driver_id,
+            vehicle_id=vid,
+            start_datetime_planned=datetime(2029, 8, 1, 8, 0),
+            end_datetime_planned=datetime(2029, 8, 1, 18, 0),
+            route_from="A", route_to="B", purpose="T", status="pending",
+        )
+        db.session.add(b)
+        db.session.commit()
+        bid = b.id
+        login(client)
+        db.session.expire_all()
+        with count_queries() as statements:
+            r = client.post(f"/bookings/{bid}/approve")
+        assert r.status_code == 302
+        # vehicle, requester and driver come joined onto the booking query
+        assert _vehicle_selects(statements) == []
+        assert any("LEFT OUTER JOIN users AS users_2" in s for s in statements)
+
+    @staticmethod
+    def _completed_trips(reg, year, month, days=(1, 2, 3)):
+        """Vehicle *reg* with one completed, driven trip per day; returns its id."""
+        admin_id = _admin_id()
+        driver_id = User.query.filter_by(username="testdriver").first().id
+        v = Vehicle(registration_number=reg, make="Toyota", model="Hilux")
+        db.session.add(v)
+        db.session.flush()
+        for day in days:
+            b = Booking(
+                requester_name="Test", requester_id=admin_id, driver_id=driver_id,
+                vehicle_id=v.id,
+                start_datetime_planned=datetime(year, month, day, 8, 0),
+                end_datetime_planned=datetime(year, month, day, 18, 0),
+                route_from="A", route_to="B", purpose="T", status="completed",
+            )
+            db.session.add(b)
+            db.session.flush()
+            db.session.add(Trip(
+                booking_id=b.id,
+                start_actual_datetime=datetime(year, month, day, 8, 30),
+                end_actual_datetime=datetime(year, month, day, 17, 0),
+                odometer_start=100, odometer_end=150, distance=50,
+            ))
+        db.session.commit()
+        return v.id
+
+    def test_booking_delete_loads_vehicle_and_trip_in_one_query(self, client, app, admin_user,
+                                                                driver_user):
+        vid = self._completed_trips("RPT 004", 2028, 12, days=(1,))
+        bid = Booking.query.filter_by(vehicle_id=vid).one().id
+        login(client)
+        db.session.expire_all()
+        with count_queries() as statements:
+            r = client.post(f"/bookings/{bid}/delete")
+        assert r.status_code == 302
+        assert _vehicle_selects(statements) == []
+        assert not [s for s in statements if s.startswith("SELECT trips.")]
+        db.session.expire_all()
+        assert Trip.query.filter_by(booking_id=bid).one().is_deleted is True
+
+    def test_vehicle_report_loads_trip_bookings_with_trips(self, client, app, admin_user,
+                                                           driver_user):
+        vid = self._completed_trips("RPT 001", 2028, 9)
+        login(client)
+        db.session.expire_all()
+        with count_queries() as statements:
+            r = client.get(
+                f"/reports/vehicle?vehicle_id={vid}&date_from=2028-09-01&date_to=2028-09-30"
+            )
+        assert r.status_code == 200
+        assert b"<strong>150 km</strong>" in r.data  # total distance
+        assert not [s for s in statements if s.startswith("SELECT bookings.")]
+        assert len([s for s in statements if s.startswith("SELECT users.")]) <= 1  # load_user
+
+    def test_vehicle_report_export_query_count_is_flat(self, client, app, admin_user,
+                                                       driver_user):
+        few = self._completed_trips("RPT 002", 2028, 10, days=(1,))
+        many = self._completed_trips("RPT 003", 2028, 11, days=range(1, 9))
+        login(client)
+        counts = []
+        for vid, month in ((few, 10), (many, 11)):
+            db.session.expire_all()
+            with count_queries() as statements:
+                r = client.get(
+                    f"/reports/vehicle/export?vehicle_id={vid}"
+                    f"&date_from=2028-{month}-01&date_to=2028-{month}-28"
+                )
+            assert r.status_code == 200
+            counts.append(len([s for s in statements if s.startswith("SELECT")]))
+        assert counts[0] == counts[1]
+
+    def test_api_bookings_runs_one_query(self, client, app, admin_user):
+        self._make_bookings(_admin_id(), "pending", prefix="CAL")
+        login(client)
+        db.session.expire_all()
+        with count_queries() as statements:
+            r = client.get("/api/bookings")
+        assert r.status_code == 200
+        assert len(r.get_json()) >= 3
+        assert _vehicle_selects(statements) == []
+        assert len([s for s in statements if "FROM bookings" in s]) == 1
+
+    def test_budget_report_scans_completed_trip_index(self, app):
+        plan = db.session.execute(db.text(
+            "EXPLAIN QUERY PLAN "
+            "SELECT bookings.project_code, count(trips.id) FROM bookings "
+            "JOIN trips ON trips.booking_id = bookings.id "
+            "WHERE trips.end_actual_datetime IS NOT NULL "
+            "AND trips.is_deleted = 0 AND bookings.is_deleted = 0 "
+            "GROUP BY bookings.project_code"
+        )).all()
+        assert any("ix_trip_completed_start" in row[-1] for row in plan)
+
+    def test_dashboard_upcoming_seeks_status_end_index(self, app):
+        plan = db.session.execute(db.text(
+            "EXPLAIN QUERY PLAN SELECT id FROM bookings "
+            "WHERE status = 'approved' AND is_deleted = 0 "
+            "AND end_datetime_planned >= '2030-01-01' "
+            "ORDER BY start_datetime_planned LIMIT 10"
+        )).all()
+        assert any("ix_booking_status_end" in row[-1] for row in plan)
+
+    def test_conflict_check_seeks_covering_conflict_index(self, app):
+        plan = db.session.execute(db.text(
+            "EXPLAIN QUERY PLAN SELECT id FROM bookings "
+            "WHERE vehicle_id = 1 AND status IN ('pending', 'approved') AND is_deleted = 0 "
+            "AND start_datetime_planned < '2030-01-02' AND end_datetime_planned > '2030-01-01' "
+            "LIMIT 1"
+        )).all()
+        assert any(
+            "COVERING INDEX ix_booking_conflict" in row[-1]
+            and "end_datetime_planned>" in row[-1]
+            for row in plan
+        )
+
+    def test_dashboard_hides_past_approved_bookings(self, client, app, admin_user):
+        admin_id = _admin_id()
+        v = Vehicle(registration_number="OLD 001", make="Toyota", model="Hilux")
+        db.session.add(v)
+        db.session.flush()
+        db.session.add(Booking(
+            requester_name="Test", requester_id=admin_id, vehicle_id=v.id,
+            start_datetime_planned=datetime(2021, 1, 1, 8, 0),
+            end_datetime_planned=datetime(2021, 1, 1, 18, 0),
+            route_from="Yesteryear", route_to="B", purpose="T", status="approved",
+        ))
+        db.session.commit()
+        login(client)
+        r = client.get("/")
+        assert r.status_code == 200
+        assert b"Yesteryear" not in r.data
+
+
+    def test_picker_choices_cached_until_a_change_commits(self, app, admin_user):
+        from app import driver_choices, invalidate_vehicle_choices, vehicle_choices
+
+        invalidate_vehicle_choices()
+        vehicle_choices(), driver_choices()
+        with count_queries() as queries:
+            vehicle_choices(), driver_choices()
+        assert queries == []
+
+        db.session.add(Vehicle(registration_number="PCK 001", make="Toyota", model="Hilux"))
+        db.session.commit()
+        assert "PCK 001" in [row.registration_number for row in vehicle_choices()]
+
+        u = User(username="pickdriver", email="pickdriver@test.org", full_name="Pick Driver", role="driver")
+        u.set_password("password123")
+        db.session.add(u)
+        db.session.commit()
+        assert "Pick Driver" in [row.full_name for row in driver_choices()]
+
+    def test_dashboard_counts_cached_until_a_change_commits(self, app, admin_user):
+        from app import get_dashboard_counts, invalidate_dashboard_counts
+
+        criteria = (Booking.status == "approved", Booking.is_deleted == False)
+        invalidate_dashboard_counts()
+        vehicles = get_dashboard_counts(criteria)[0]
+        with count_queries() as queries:
+            assert get_dashboard_counts(criteria)[0] == vehicles
+        assert queries == []
+        db.session.add(Vehicle(registration_number="DSH 001", make="Toyota", model="Hilux"))
+        db.session.commit()
+        assert get_dashboard_counts(criteria)[0] == vehicles + 1
+        db.session.execute(
+            db.update(Vehicle).where(Vehicle.registration_number == "DSH 001").values(is_deleted=True)
+        )
+        db.session.commit()
+        assert get_dashboard_counts(criteria)[0] == vehicles
+
+# ╔═══════════════════════════════════════════════════════════════════════════╗
+# ║  10. HTTP CACHING                                                        ║
+# ╚═══════════════════════════════════════════════════════════════════════════╝
+
+
+class TestConditionalGet:
+    def test_vehicle_list_revalidates_with_304(self, client, admin_user, vehicle):
+        login(client)
+        client.get("/")  # consume the login flash message
+        r = client.get("/vehicles")
+        assert r.status_code == 200
+        assert r.headers.get("ETag")
+        assert "no-cache" in r.headers["Cache-Control"]
+        r2 = client.get("/vehicles", headers={"If-None-Match": r.headers["ETag"]})
+        assert r2.status_code == 304
+        assert r2.data == b""
+
+    def test_vehicle_change_invalidates_etag(self, client, admin_user, vehicle):
+        login(client)
+        client.get("/")
+        etag = client.get("/vehicles").headers["ETag"]
+        v = Vehicle.query.filter_by(registration_number="KAA 001A").first()
+        v.make = "Nissan" if v.make != "Nissan" else "Toyota"
+        db.session.commit()
+        r = client.get("/vehicles", headers={"If-None-Match": etag})
+        assert r.status_code == 200
+
+    def test_viewer_email_change_invalidates_etag(self, client, admin_user, vehicle):
+        login(client)
+        client.get("/")
+        etag = client.get("/vehicles").headers["ETag"]
+        user = User.query.filter_by(username="testadmin").first()
+        user.email = "etag-" + user.email if not user.email.startswith("etag-") else user.email[5:]
+        db.session.commit()
+        r = client.get("/vehicles", headers={"If-None-Match": etag})
+        assert r.status_code == 200
+        assert user.email.encode() in r.data
+
+    def test_if_modified_since_alone_is_not_304(self, client, admin_user, vehicle):
+        login(client)
+        client.get("/")
+        last_modified = client.get("/vehicles").headers["Last-Modified"]
+        r = client.get("/vehicles", headers={"If-Modified-Since": last_modified})
+        assert r.status_code == 200
+
+    def test_pending_flash_is_never_304(self, client, admin_user):
+        login(client)
+        client.get("/")
+        etag = client.get("/users").headers["ETag"]
+        with client.session_transaction() as sess:
+            sess["_flashes"] = [("info", "Flash for the user list")]
+        r = client.get("/users", headers={"If-None-Match": etag})
+        assert r.status_code == 200
+        assert b"Flash for the user list" in r.data
+
+    def test_calendar_feed_revalidates_with_304(self, client, admin_user):
+        login(client)
+        feed = "/api/bookings?start=2033-01-01&end=2033-02-01"
+        r = client.get(feed)
+        assert r.status_code == 200
+        etag = r.headers["ETag"]
+        assert client.get(feed, headers={"If-None-Match": etag}).status_code == 304
+
+        v = Vehicle(registration_number="ETG 001", make="Toyota", model="Hilux")
+        db.session.add(v)
+        db.session.flush()
+        db.session.add(Booking(
+            requester_name="Test", requester_id=_admin_id(), vehicle_id=v.id,
+            start_datetime_planned=datetime(2033, 1, 10, 8, 0),
+            end_datetime_planned=datetime(2033, 1, 10, 18, 0),
+            route_from="A", route_to="B", purpose="T", status="pending",
+        ))
+        db.session.commit()
+        r = client.get(feed, headers={"If-None-Match": etag})
+        assert r.status_code == 200
+        assert any(e["title"].startswith("ETG 001") for e in r.get_json())